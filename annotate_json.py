@@ -7,37 +7,111 @@ import sys
 import json
 import argparse
 from queue import SimpleQueue
+from array import array
+import heapq
+import itertools
+import time
+import mmap
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import string
+import io
+import gzip
+import glob
+import contextlib
+import tree_cache
+import profiling
+from json_stream import open_text, iter_events, iter_value_events, build_value, skip_value
+
+def value_list(cast):
+    return lambda v: [cast(x) for x in v.split(",")]
+
+def common_parser(sweep=False):
+    """
+    Return a parent parser with the options shared by every command. For sweeps, lineage parameters take comma-separated lists of values.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    def parameter(short, name, cast, default, help):
+        if sweep:
+            parser.add_argument(short, name, type=value_list(cast), default=[default], help=help + " Pass several values with ',' delimiters to sweep over them.")
+        else:
+            parser.add_argument(short, name, type=cast, default=default, help=help)
+    parameter("-f","--floor",int,0,"Set a minimum total value to annotate a lineage.")
+    parameter("-s","--size",int,0,"Set a minimum number of samples to annotate a lineage.")
+    parameter("-d","--distinction",int,0,"Set a minimum number of mutations separating a new lineage label with its parent.")
+    parameter("-c","--cutoff",float,1,"Proportion of samples that must be labeled on each level.")
+    parameter("-l","--levels",int,0,"Set a maximum number of levels to annotate. Default does as many as possible.")
+    parser.add_argument("-m","--missense",action='store_true',default=False,help="Use to only consider amino-acid altering mutations.")
+    parser.add_argument("-g","--gene",default=None,help="Only consider missense mutations within a specific gene. Pass multiple genes with ',' delimiters (e.g. S,E). Sets -m.")
+    if not sweep:
+        parser.add_argument("-z","--gzip",action='store_true',default=False,help="Write the annotated JSON gzip-compressed.")
+        parser.add_argument("--stream",action='store_true',default=False,help="Build the tree while reading the input incrementally instead of loading the whole JSON first. Inputs nested too deeply for json.load are always streamed.")
+    parser.add_argument("--cache",nargs='?',const="",default=None,metavar="DIR",help="Cache the loaded tree in DIR, or next to the input if no directory is given, so that later runs on the same input skip loading, even with different mutation settings. Implies --compact.")
+    parser.add_argument("--cache-size",type=int,default=1024,help="Maximum size of the tree cache in megabytes; least recently used trees are evicted first.")
+    parser.add_argument("--compact",action='store_true',default=False,help="Store the tree in flat arrays instead of node objects. Uses much less memory on very large trees.")
+    return parser
+
+def sweep_argparser(argv):
+    parser = argparse.ArgumentParser(prog="annotate_json.py sweep", description="Annotate a Nextstrain JSON under every combination of the given parameter values, loading the tree only once, and summarize the results.", parents=[common_parser(sweep=True)])
+    parser.add_argument("-i","--input",help="Name of an input JSON.",required=True)
+    parser.add_argument("-o","--output",help="Name of the output summary table.",required=True)
+    parser.add_argument("-O","--outdir",default=None,help="Write the labels and report of each combination to this directory.")
+    parser.add_argument("-j","--jobs",type=int,default=1,help="Number of worker processes used to run combinations in parallel.")
+    return parser.parse_args(argv)
+
+def batch_argparser(argv):
+    parser = argparse.ArgumentParser(prog="annotate_json.py batch", description="Annotate many Nextstrain JSONs in one run across a pool of worker processes, continuing past any that fail.", parents=[common_parser()])
+    parser.add_argument("-i","--input",nargs='+',default=[],help="Input JSONs or glob patterns matching them.")
+    parser.add_argument("-M","--manifest",default=None,help="TSV with an input column naming each JSON, and optional floor, size, distinction, cutoff, levels, missense and gene columns overriding the parameters for that file. Empty cells keep the defaults.")
+    parser.add_argument("-O","--outdir",help="Directory to write each input's annotated JSON, labels, report and log to, along with a summary of the run.",required=True)
+    parser.add_argument("-j","--jobs",type=int,default=1,help="Number of worker processes annotating inputs in parallel.")
+    parser.add_argument("--max-large",type=int,default=1,help="Maximum number of large inputs being annotated at once.")
+    parser.add_argument("--large-mb",type=float,default=100,help="Inputs of at least this many megabytes count as large.")
+    args = parser.parse_args(argv)
+    if args.max_large < 1:
+        parser.error("--max-large must be at least 1.")
+    return args
 
 def argparser():
-    parser = argparse.ArgumentParser(description="Simple implementation of the genotype representation metric for automated lineage designation for arbitrary Nextstrain JSON.")
+    parser = argparse.ArgumentParser(description="Simple implementation of the genotype representation metric for automated lineage designation for arbitrary Nextstrain JSON.", parents=[common_parser()])
     parser.add_argument("-i","--input",help="Name of an input JSON.",required=True)
     parser.add_argument("-o","--output",help="Name of an output annotated JSON.",required=True)
-    parser.add_argument("-f","--floor",type=int,default=0,help="Set a minimum total value to annotate a lineage.")
-    parser.add_argument("-s","--size",type=int,default=0,help="Set a minimum number of samples to annotate a lineage.")
-    parser.add_argument("-d","--distinction",type=int,default=0,help="Set a minimum number of mutations separating a new lineage label with its parent.")
-    parser.add_argument("-c","--cutoff",type=float,default=1,help="Proportion of samples that must be labeled on each level.")
-    parser.add_argument("-m","--missense",action='store_true',default=False,help="Use to only consider amino-acid altering mutations.")
-    parser.add_argument("-g","--gene",default=None,help="Only consider missense mutations within a specific gene. Pass multiple genes with ',' delimiters (e.g. S,E). Sets -m.")
-    parser.add_argument("-l","--levels",default=0,type=int,help="Set a maximum number of levels to annotate. Default does as many as possible.")
     parser.add_argument("-a","--labels",help="Write sample-lineage associations to the target files.",default=None)
     parser.add_argument("-r","--report",help="Write a report with statistics about generated lineages to the target file.",default=None)
-    return parser.parse_args()
+    parser.add_argument("-j","--jobs",type=int,default=1,help="Number of worker processes used to subdivide the lineages of each level in parallel. Output is identical to a serial run.")
+    parser.add_argument("--previous-report",default=None,help="Report written by an earlier run on an older version of this tree. Its lineage names are kept and only lineages that gained or lost samples are subdivided again. Requires --previous-labels.")
+    parser.add_argument("--previous-labels",default=None,help="Sample-lineage associations written by the same earlier run as --previous-report.")
+    parser.add_argument("--profile",default=None,metavar="FILE",help="Write a JSON trace with the time and memory of each stage and the work done on each level and lineage to FILE.")
+    parser.add_argument("--profile-dir",default=None,metavar="DIR",help="Also run each stage under cProfile and write its statistics to DIR/<stage>.prof.")
+    args = parser.parse_args()
+    if (args.previous_report == None) != (args.previous_labels == None):
+        parser.error("--previous-report and --previous-labels must be used together.")
+    return args
 
 def dists_to_root(node):
-    #nodes must be a dict that gets updated on each recursion
     #gives back a dict with all nodes and their respective dist from root
     #initalize this with our starting node at 0, its our "root" whether its the actual tree root or not
+    #uses an explicit stack rather than recursion so that very deep trees don't exceed the recursion limit.
     nodes = {node.id:0}
-    def recursive_dists_to_roots(snode):
+    stack = [node]
+    while stack:
+        snode = stack.pop()
         bweight = nodes[snode.id]
         for child in snode.children:
-            dist = bweight + len(child.mutations) 
-            nodes[child.id] = dist
-            recursive_dists_to_roots(child)
-    recursive_dists_to_roots(node)
+            nodes[child.id] = bweight + child.mutation_count
+            stack.append(child)
     return nodes
 
+def dists_in_region(nodes):
+    """
+    Distances from nodes[0] for a list of nodes in preorder, each of which but the first has its parent earlier in the list.
+    """
+    dists = {nodes[0].id:0}
+    for node in nodes[1:]:
+        dists[node.id] = dists[node.parent.id] + node.mutation_count
+    return dists
+
 def get_sum_and_count(rbfs, ignore = set()):
     """
     Construct a dictionary storing node-wise sum and count values used for efficiently computing the GRI downstream.
@@ -49,7 +123,7 @@ def get_sum_and_count(rbfs, ignore = set()):
         if node.is_leaf():
             leaf_count += 1
             if node.id not in ignore:
-                sum_and_count_dict[node.id] = (len(node.mutations), 1)
+                sum_and_count_dict[node.id] = (node.mutation_count, 1)
         else:
             total_count = 0
             total_sum = 0
@@ -66,9 +140,41 @@ def get_sum_and_count(rbfs, ignore = set()):
                 #but for an internal node with two leaf children's path length with respect to its parent, 
                 #its equal to the sum of the two child's path lengths plus 2 times its mutations, since those mutations are shared among 2 samples
                 #this logic applies as we move further up the tree.
-                sum_and_count_dict[node.id] = (total_sum + len(node.mutations) * total_count, total_count)
+                sum_and_count_dict[node.id] = (total_sum + node.mutation_count * total_count, total_count)
     return sum_and_count_dict, leaf_count
 
+def remove_from_sum_and_count(sum_and_count_dict, node, stop_id):
+    """
+    Update a sum and count dictionary in place after every leaf descended from node has been labeled.
+
+    Equivalent to recomputing get_sum_and_count with those leaves ignored, but only visits the subtree of node and its ancestors up to stop_id.
+    Returns the ids of every node whose entry changed.
+    """
+    node_sum, node_count = sum_and_count_dict.get(node.id, (0,0))
+    changed = []
+    if node_count == 0:
+        return changed
+    #every descendent is left with no unlabeled samples, so drops out of the dictionary entirely.
+    #a node without an entry has no unlabeled samples, so neither do any of its descendents and they can be skipped.
+    stack = [node]
+    while stack:
+        cnode = stack.pop()
+        if sum_and_count_dict.pop(cnode.id, None) != None:
+            changed.append(cnode.id)
+            stack.extend(cnode.children)
+    #each ancestor loses the removed samples, which are also now one more branch further away from it.
+    cnode = node
+    while cnode.id != stop_id and cnode.parent != None:
+        cnode = cnode.parent
+        node_sum += cnode.mutation_count * node_count
+        asum, acount = sum_and_count_dict[cnode.id]
+        if acount == node_count:
+            del sum_and_count_dict[cnode.id]
+        else:
+            sum_and_count_dict[cnode.id] = (asum - node_sum, acount - node_count)
+        changed.append(cnode.id)
+    return changed
+
 def evaluate_candidate(a, nid, sum_and_counts, dist_to_root, minimum_size=0,minimum_distinction=0):
     """Evaluate a candidate branch as a putative sublineage by computing and returning the GRI.
 
@@ -104,43 +210,344 @@ def evaluate_lineage(t, dist_to_root, anid, candidates, sum_and_count, minimum_s
         return (0,None)
     return max(good_candidates, key=lambda x: x[0])
 
-def update_json(ijd, labels, annd, levels=0):
-    for l in range(0,levels):
-        ijd['meta']['colorings'].append({"key":"GRI Lineage Level "+str(l),"title":"GRI Lineage Level "+str(l),"type":"categorical"})
-    treed = ijd['tree']
-    global id_counter 
+class CandidateHeap:
+    '''
+    Max-heap of candidate lineage roots ordered by GRI, as a drop-in for repeated calls to evaluate_lineage.
+
+    Entries are invalidated lazily; only nodes passed to update are rescored. Ties go to the earliest node in candidates, matching max(),
+    unless rank is given as a function returning each candidate's tie-breaking order.
+    '''
+    def __init__(self, anid, candidates, sum_and_count, dist_to_root, minimum_size = 0, minimum_distinction = 0, banned = set(), rank = None):
+        self.anid = anid
+        self.sum_and_count = sum_and_count
+        self.dist_to_root = dist_to_root
+        self.minimum_size = minimum_size
+        self.minimum_distinction = minimum_distinction
+        self.banned = banned
+        self.nodes = {}
+        self.rank = {}
+        self.scores = {}
+        self.heap = []
+        self.evaluations = 0
+        for i, c in enumerate(candidates):
+            if rank != None:
+                i = rank(c)
+            self.nodes[c.id] = c
+            self.rank[c.id] = i
+            cscore = self.__score(c.id)
+            if cscore > 0:
+                self.scores[c.id] = cscore
+                self.heap.append((-cscore, i, c.id))
+        self.evaluations += len(self.nodes)
+        heapq.heapify(self.heap)
+
+    def __score(self, nid):
+        if nid in self.banned:
+            return 0
+        return evaluate_candidate(self.anid, nid, self.sum_and_count, self.dist_to_root, self.minimum_size, self.minimum_distinction)
+
+    def update(self, nids):
+        '''
+        Rescore nodes whose sum and count changed or which have been banned since the last update.
+        '''
+        self.evaluations += len(nids)
+        for nid in nids:
+            if nid not in self.rank:
+                continue
+            cscore = self.__score(nid)
+            if cscore == self.scores.get(nid, 0):
+                continue
+            if cscore > 0:
+                self.scores[nid] = cscore
+                heapq.heappush(self.heap, (-cscore, self.rank[nid], nid))
+            else:
+                self.scores.pop(nid, None)
+
+    def best(self):
+        #discard stale entries left behind by rescored nodes until the top of the heap is current.
+        while len(self.heap) > 0:
+            nscore, _, nid = self.heap[0]
+            if self.scores.get(nid, 0) == -nscore:
+                return (-nscore, self.nodes[nid])
+            heapq.heappop(self.heap)
+        return (0,None)
+
+def write_annotated_json(ijd, ojson, labels, annd, levels=0, tree=None, compress=False):
+    """
+    Write the input Auspice JSON to ojson with lineage annotations added, streaming it node by node instead of building the annotated document.
+
+    Level colorings are added to the metadata, lineage roots in annd get a 'GRI Lineage Root' branch label and every node gets a level attribute
+    per level, without altering the input; with no levels or roots, the output is what json.dump writes. The input can be a dictionary, a filename
+    or an open file, which is read again from the start. If tree is given, it resolves the sample name of nodes that list node_attrs before their name.
+    """
+    level_keys = ['GRI Lineage Level '+str(l) for l in range(0,levels)]
+    inf = None
+    if type(ijd) == dict:
+        events = iter_value_events(ijd)
+    else:
+        if type(ijd) != str:
+            ijd.seek(0)
+        inf = open_text(ijd)
+        events = iter_events(inf)
+    if compress:
+        #a fixed timestamp keeps compressed output reproducible.
+        of = io.TextIOWrapper(gzip.GzipFile(ojson, 'wb', mtime=0))
+    else:
+        of = open(ojson,'w+')
+    out = []
+    def node_label(frame):
+        #samples are found under their name and everything else under its depth-first location, node_N for the Nth node visited.
+        if 'flabel' not in frame:
+            name = frame['name']
+            if name == None and tree != None:
+                name = tree.node_at(frame['idx']).id
+            flabel = labels.get(name,'not assigned') if name != None else 'not assigned'
+            if flabel == 'not assigned':
+                flabel = labels.get(frame['nid'],'not assigned')
+            frame['flabel'] = flabel
+        return frame['flabel']
+    def level_value(frame, key):
+        l = level_keys.index(key)
+        return json.dumps({'value':".".join(node_label(frame).split(".")[:l+1])})
+    #each frame records what part of the document a container is, whether it has had an entry written yet,
+    #and the node it belongs to, if any.
+    stack = []
+    key = None
     id_counter = 0
-    def traverse(cnd):
-        #the node id of a given node is its position on the depth-first order.
-        global id_counter
-        nid = "node_" + str(id_counter)
-        id_counter += 1
-        # flabel = 'not assigned'
-        #if its a lineage root, add that information as a branch_attrs label.
-        if nid in annd:
-            if 'branch_attrs' in cnd:
-                if 'labels' not in cnd['branch_attrs']:
-                    cnd['branch_attrs']['labels'] = {}
-                cnd['branch_attrs']['labels']['GRI Lineage Root'] = ",".join(annd[nid])
-        if "name" in cnd.keys():
-            flabel = labels.get(cnd['name'],'not assigned')
-        if flabel == 'not assigned':
-            #try finding it under its dfs location.
-            flabel = labels.get(nid,'not assigned')
-        for l in range(0,levels):
-            stripped = ".".join(flabel.split(".")[:l+1])
-            if 'node_attrs' in cnd:
-                cnd['node_attrs']['GRI Lineage Level '+str(l)] = {'value':stripped}
-        for nd in cnd.get("children",[]):
-            traverse(nd)
-    traverse(treed)
-    ijd['treed'] = treed
-    return ijd
+    try:
+        for kind, value in events:
+            frame = stack[-1] if stack else None
+            if kind == 'map_key':
+                if not frame['first']:
+                    out.append(', ')
+                frame['first'] = False
+                out.append(json.dumps(value) + ': ')
+                key = value
+                replacement = None
+                if frame['role'] == 'node_attrs' and value in level_keys:
+                    frame['done'].add(value)
+                    replacement = level_value(frame['node'], value)
+                elif frame['role'] == 'labels' and value == 'GRI Lineage Root' and frame['node']['nid'] in annd:
+                    frame['done'].add(value)
+                    replacement = json.dumps(",".join(annd[frame['node']['nid']]))
+                elif frame['role'] == 'branch_attrs' and value == 'labels':
+                    frame['has_labels'] = True
+                elif frame['role'] == 'meta' and value == 'colorings':
+                    frame['has_colorings'] = True
+                if replacement != None:
+                    vkind, _ = next(events)
+                    skip_value(events, vkind)
+                    out.append(replacement)
+                continue
+            if kind == 'end_map' or kind == 'end_array':
+                stack.pop()
+                role = frame['role']
+                extra = []
+                if role == 'node_attrs':
+                    extra = [json.dumps(k) + ': ' + level_value(frame['node'], k) for k in level_keys if k not in frame['done']]
+                elif role == 'labels' and frame['node']['nid'] in annd and 'GRI Lineage Root' not in frame['done']:
+                    extra = ['"GRI Lineage Root": ' + json.dumps(",".join(annd[frame['node']['nid']]))]
+                elif role == 'branch_attrs' and frame['node']['nid'] in annd and not frame['has_labels']:
+                    extra = ['"labels": ' + json.dumps({'GRI Lineage Root':",".join(annd[frame['node']['nid']])})]
+                elif role == 'colorings':
+                    extra = [json.dumps({"key":k,"title":k,"type":"categorical"}) for k in level_keys]
+                elif role == 'meta' and not frame['has_colorings'] and len(level_keys) > 0:
+                    extra = ['"colorings": ' + json.dumps([{"key":k,"title":k,"type":"categorical"} for k in level_keys])]
+                for e in extra:
+                    if not frame['first']:
+                        out.append(', ')
+                    frame['first'] = False
+                    out.append(e)
+                out.append('}' if kind == 'end_map' else ']')
+            else:
+                if frame != None and not frame['is_map']:
+                    if not frame['first']:
+                        out.append(', ')
+                    frame['first'] = False
+                if kind == 'value':
+                    out.append(json.dumps(value))
+                    if frame != None and frame['role'] == 'node' and key == 'name':
+                        frame['name'] = value
+                else:
+                    is_map = kind == 'start_map'
+                    out.append('{' if is_map else '[')
+                    prole = frame['role'] if frame != None else None
+                    if frame != None and frame['is_map']:
+                        ckey = key
+                    else:
+                        ckey = None
+                    role = 'other'
+                    if prole == None:
+                        role = 'top'
+                    elif prole == 'top' and ckey == 'meta' and is_map:
+                        role = 'meta'
+                    elif prole == 'meta' and ckey == 'colorings' and not is_map:
+                        role = 'colorings'
+                    elif ((prole == 'top' and ckey == 'tree') or prole == 'children') and is_map:
+                        role = 'node'
+                    elif prole == 'node' and ckey == 'children' and not is_map:
+                        role = 'children'
+                    elif prole == 'node' and ckey == 'node_attrs' and is_map:
+                        role = 'node_attrs'
+                    elif prole == 'node' and ckey == 'branch_attrs' and is_map:
+                        role = 'branch_attrs'
+                    elif prole == 'branch_attrs' and ckey == 'labels' and is_map:
+                        role = 'labels'
+                    nframe = {'role':role, 'is_map':is_map, 'first':True}
+                    if role == 'node':
+                        nframe.update({'idx':id_counter, 'nid':"node_" + str(id_counter), 'name':None})
+                        id_counter += 1
+                    elif role == 'node_attrs' or role == 'labels':
+                        nframe.update({'node':frame if role == 'node_attrs' else frame['node'], 'done':set()})
+                    elif role == 'branch_attrs':
+                        nframe.update({'node':frame, 'has_labels':False})
+                    elif role == 'meta':
+                        nframe['has_colorings'] = False
+                    stack.append(nframe)
+            if len(out) > 4096:
+                of.write("".join(out))
+                out.clear()
+        of.write("".join(out))
+    finally:
+        of.close()
+        if inf != None and inf is not ijd:
+            if type(ijd) == str:
+                inf.close()
+            else:
+                inf.detach()
+
+class MutationTable:
+    '''
+    Every distinct mutation on a tree, in every category, stored once under an integer id along with the gene it falls in.
+
+    Nucleotide mutations are filed under the gene 'nuc'. Trees keep the ids of all of a node's mutations and choose which ones a run
+    considers with mask, so that switching between nucleotide, missense and per-gene mutations never means reading the tree again.
+    '''
+    def __init__(self, genes=None, changes=None, gene_ids=None):
+        self.genes = genes if genes != None else []
+        self.changes = changes if changes != None else []
+        self.gene_ids = gene_ids if gene_ids != None else array('i')
+        self.gene_index = {g:i for i, g in enumerate(self.genes)}
+        #only needed while loading, so tables mapped from a saved tree never build it.
+        self.index = None
+
+    def __len__(self):
+        return len(self.changes)
+
+    def intern(self, gene, change):
+        if self.index == None:
+            self.index = {(self.gene_ids[m], c):m for m, c in enumerate(self.changes)}
+        gid = self.gene_index.get(gene, None)
+        if gid == None:
+            gid = len(self.genes)
+            self.gene_index[gene] = gid
+            self.genes.append(gene)
+        mid = self.index.get((gid, change), None)
+        if mid == None:
+            mid = len(self.changes)
+            self.index[(gid, change)] = mid
+            self.changes.append(change)
+            self.gene_ids.append(gid)
+        return mid
+
+    def intern_all(self, muinfo):
+        """
+        Return the ids of every mutation in a branch_attrs mutations entry, in the order they are listed.
+        """
+        return [self.intern(g, change) for g, changes in muinfo.items() for change in changes]
+
+    def label(self, mid):
+        gene = self.genes[self.gene_ids[mid]]
+        if gene == 'nuc':
+            return self.changes[mid]
+        return gene + ":" + self.changes[mid]
+
+    def mask(self, use_aa=False, gene=None):
+        """
+        Return a bytearray holding 1 for each mutation id considered under the missense and gene settings, and 0 for the rest.
+        """
+        selected = []
+        for g in self.genes:
+            if not use_aa and gene == None:
+                selected.append(g == 'nuc')
+            else:
+                selected.append(g != 'nuc' and ((gene == None) | (type(gene) == str and g == gene) | (type(gene) == list and g in gene)))
+        return bytearray(map(selected.__getitem__, self.gene_ids))
+
+def walk_auspice_dict(jd, tree):
+    """
+    Feed the nodes of a loaded Auspice tree dictionary to a tree's begin_node, set_mutations and end_node, in depth-first order.
+    """
+    #children are pushed in reverse so that they are visited in the same depth-first order as write_annotated_json uses for node_N ids.
+    stack = [(jd, None)]
+    while stack:
+        cjd, parent = stack.pop()
+        cnode = tree.begin_node(parent)
+        try:
+            muinfo = cjd['branch_attrs']['mutations']
+        except KeyError:
+            print(f"WARNING: mutations attribute not found for node!",file=sys.stderr)
+            muinfo = {}
+        tree.set_mutations(cnode, muinfo)
+        tree.end_node(cnode, cjd.get('name', None), 'children' in cjd.keys())
+        stack.extend((child, cnode) for child in reversed(cjd.get("children",[])))
+
+def stream_auspice_tree(inf, tree):
+    """
+    Feed the nodes of an Auspice v2 JSON to a tree's begin_node, set_mutations and end_node while reading it incrementally from inf.
+
+    Only names, mutations and children are kept; every other part of the document is skipped as it is read.
+    """
+    events = iter_events(inf)
+    kind, _ = next(events)
+    if kind != 'start_map':
+        raise Exception("Input is not an Auspice v2 JSON!")
+    for kind, key in events:
+        if kind != 'map_key':
+            break
+        kind, value = next(events)
+        if key != 'tree' or kind != 'start_map':
+            skip_value(events, kind)
+            continue
+        #each frame holds a node, its name, whether it has a children entry and whether mutations were found for it.
+        stack = [[tree.begin_node(None), None, False, False]]
+        for kind, value in events:
+            if kind == 'start_map':
+                #only nodes in a children array open a map at this level.
+                stack.append([tree.begin_node(stack[-1][0]), None, False, False])
+            elif kind == 'end_map':
+                cnode, name, has_children, has_mutations = stack.pop()
+                if not has_mutations:
+                    print("WARNING: mutations attribute not found for node!",file=sys.stderr)
+                tree.end_node(cnode, name, has_children)
+                if len(stack) == 0:
+                    return tree
+            elif kind == 'map_key':
+                frame = stack[-1]
+                key = value
+                vkind, value = next(events)
+                if key == 'children' and vkind == 'start_array':
+                    frame[2] = True
+                elif key == 'name':
+                    frame[1] = build_value(events, vkind, value)
+                elif key == 'branch_attrs' and vkind == 'start_map':
+                    for bkind, bkey in events:
+                        if bkind != 'map_key':
+                            break
+                        bkind, value = next(events)
+                        if bkey == 'mutations':
+                            tree.set_mutations(frame[0], build_value(events, bkind, value))
+                            frame[3] = True
+                        else:
+                            skip_value(events, bkind)
+                else:
+                    skip_value(events, vkind)
+    raise Exception("Input JSON does not contain a tree!")
 
 class TreeNode:
-    def __init__(self, nid, parent=None, mutations=[]):
+    def __init__(self, nid, parent=None, mutations=None):
         self.id = nid
-        self.mutations = mutations
+        self.mutations = mutations if mutations != None else []
         self.children = []
         self.parent = parent
 
@@ -150,6 +557,10 @@ class TreeNode:
     def add_mutation(self, obj):
         self.mutations.append(obj)
 
+    @property
+    def mutation_count(self):
+        return len(self.mutations)
+
     def is_leaf(self):
         return (len(self.children) == 0)
 
@@ -162,50 +573,187 @@ class TreeNode:
     def __repr__(self):
         return "\n".join(["id: "+self.id,"# of mutations: "+str(len(self.mutations)),"# of children: "+str(len(self.children))])
 
-class Tree:
+class SubtreeIndex:
+    '''
+    Preorder (Euler tour) index giving every subtree a contiguous [start, end) range of node positions, built once after loading.
+
+    Subclasses set self.ends to the end of each node's range, give each node an idx attribute holding its position, and implement node_at.
+    '''
+    def build_index(self):
+        #prefix sums of leaves turn any subtree leaf count into a single subtraction.
+        self.leaf_prefix = array('i',[0]) * (len(self.ends) + 1)
+        for idx in range(len(self.ends)):
+            self.leaf_prefix[idx+1] = self.leaf_prefix[idx] + (self.ends[idx] == idx + 1)
+        #breadth-first order restricted to any subtree matches a breadth-first search started from that subtree's root,
+        #so positions in a single global search are enough to reproduce the ordering of breadth_first_expansion on any subtree.
+        self.bfs_positions = array('i',[0]) * len(self.ends)
+        bfs = [0]
+        i = 0
+        while i < len(bfs):
+            idx = bfs[i]
+            self.bfs_positions[idx] = i
+            cidx = idx + 1
+            while cidx < self.ends[idx]:
+                bfs.append(cidx)
+                cidx = self.ends[cidx]
+            i += 1
+
+    def subtree_range(self, node):
+        return node.idx, self.ends[node.idx]
+
+    def count_leaves(self, node):
+        return self.leaf_prefix[self.ends[node.idx]] - self.leaf_prefix[node.idx]
+
+    def subtree(self, node, reverse=False):
+        '''
+        Return every node descended from node, inclusive, in preorder. Reversed, children always precede their parents.
+        '''
+        if reverse:
+            positions = range(self.ends[node.idx]-1, node.idx-1, -1)
+        else:
+            positions = range(node.idx, self.ends[node.idx])
+        return [self.node_at(idx) for idx in positions]
+
+    def subtree_outside(self, node, excluded):
+        '''
+        Return the nodes of node's subtree, in preorder, leaving out every node inside one of the excluded subtrees.
+        '''
+        skip = {n.idx:self.ends[n.idx] for n in excluded}
+        nodes = []
+        idx = node.idx
+        while idx < self.ends[node.idx]:
+            if idx in skip:
+                idx = skip[idx]
+            else:
+                nodes.append(self.node_at(idx))
+                idx += 1
+        return nodes
+
+    def reverse_bfs_rank(self, node):
+        return -self.bfs_positions[node.idx]
+
+class TreeLoader:
+    '''
+    Loading of a tree from an Auspice v2 JSON, shared by Tree and CompactTree.
+
+    Nodes are added in depth-first preorder, so a node's position is also the N in its node_N id, and positions are what loading passes
+    around as parents. The ids of each node's mutations in every category are kept in one preorder array, node idx owning
+    mutation_ids[mutation_offsets[idx]:mutation_offsets[idx+1]]. Subclasses implement add_node and end_node to store each node, build_ends
+    to set the end of every subtree range once all nodes are in, and select_mutations.
+    '''
+    def load_from_dict(self, jd, nid_ccount = 1, aa = False, gene = None):
+        #nid_ccount is the N in the node_N id of the first node after the root; only Tree numbers from anything but 1.
+        self.__start_load(nid_ccount)
+        walk_auspice_dict(jd, self)
+        return self.__finish_load(aa, gene)
+
+    def load_from_stream(self, inf, aa = False, gene = None):
+        '''
+        Load the tree of an Auspice v2 JSON from an open text stream without loading the rest of the document.
+        '''
+        self.__start_load()
+        stream_auspice_tree(inf, self)
+        return self.__finish_load(aa, gene)
+
+    def __start_load(self, first_id = 1):
+        self.first_id = first_id
+        self.mutation_table = MutationTable()
+        self.mutation_offsets = array('q',[0])
+        self.mutation_ids = array('i')
+        self.__loaded = 0
+        self.__late_mutations = {}
+
+    def begin_node(self, parent):
+        #called once per node in depth-first order while loading; opening a node closes the mutation slice of the one before it.
+        idx = self.__loaded
+        if idx > 0:
+            self.mutation_offsets.append(len(self.mutation_ids))
+        self.__loaded += 1
+        self.add_node(idx, parent)
+        return idx
+
+    def set_mutations(self, idx, muinfo):
+        mids = self.mutation_table.intern_all(muinfo)
+        if idx == self.__loaded - 1:
+            self.mutation_ids.extend(mids)
+        else:
+            #a streamed node can list its mutations after its children; those are slotted in once loading finishes.
+            self.__late_mutations[idx] = mids
+
+    def __finish_load(self, aa, gene):
+        self.mutation_offsets.append(len(self.mutation_ids))
+        if len(self.__late_mutations) > 0:
+            mutation_ids = array('i')
+            mutation_offsets = array('q',[0])
+            for idx in range(self.__loaded):
+                if idx in self.__late_mutations:
+                    mutation_ids.extend(self.__late_mutations[idx])
+                else:
+                    mutation_ids.extend(self.mutation_ids[self.mutation_offsets[idx]:self.mutation_offsets[idx+1]])
+                mutation_offsets.append(len(mutation_ids))
+            self.mutation_ids = mutation_ids
+            self.mutation_offsets = mutation_offsets
+        del self.__late_mutations
+        #interning is over, so the lookup from mutation to id is dropped rather than kept for the life of the tree.
+        self.mutation_table.index = None
+        self.build_ends()
+        self.build_index()
+        return self.select_mutations(aa, gene)
+
+    def get_mutation_ids(self, node):
+        return [mid for mid in self.mutation_ids[self.mutation_offsets[node.idx]:self.mutation_offsets[node.idx+1]] if self.mask[mid]]
+
+class Tree(TreeLoader, SubtreeIndex):
     '''
     Minimalist tree class supporting the application of the genotype representation heuristic for lineage nomenclature creation.
     '''
     def __init__(self):
         self.root = TreeNode('node_0')
         self.nodes = {'node_0':self.root}
-        
-    def __loader(self, jd, cnode, use_aa=False, gene=None):
-        try:
-            muinfo = jd['branch_attrs']['mutations']
-        except KeyError:
-            print(f"WARNING: mutations attribute not found for node!",file=sys.stderr)
-            muinfo = {}
-        global id_counter
-        if not use_aa and gene == None:
-            if 'nuc' in muinfo.keys():
-                for m in muinfo['nuc']:
-                    cnode.add_mutation(m)
+        self.order = []
+
+    def add_node(self, idx, parent):
+        #the root is always node_0.
+        if idx == 0:
+            cnode = self.root
         else:
-            for g, aav in muinfo.items():
-                if g != 'nuc':
-                    if (gene == None) | (type(gene) == str and g == gene) | (type(gene) == list and g in gene):
-                        for aa in aav:
-                            cnode.add_mutation(g + ":" + aa)
-        for child in jd.get("children",[]):
-            if 'name' in child.keys() and 'children' not in child.keys():
-                new_nid = child['name']
+            pnode = self.order[parent]
+            cnode = TreeNode('node_' + str(idx - 1 + self.first_id), parent=pnode, mutations=[])
+            pnode.add_child(cnode)
+        cnode.idx = idx
+        self.order.append(cnode)
+
+    def end_node(self, idx, name, has_children):
+        #named leaves are stored under their sample name; everything else keeps its depth-first node_N id.
+        cnode = self.order[idx]
+        if idx > 0 and name != None and not has_children:
+            cnode.id = name
+        self.nodes[cnode.id] = cnode
+
+    def build_ends(self):
+        self.ends = array('i',[0]) * len(self.order)
+        for cnode in reversed(self.order):
+            if cnode.is_leaf():
+                self.ends[cnode.idx] = cnode.idx + 1
             else:
-                new_nid = 'node_' + str(id_counter)
-            id_counter += 1
-            child_node = self.__loader(child, TreeNode(new_nid, parent=cnode, mutations=[]), use_aa, gene)
-            if child_node != None:
-                cnode.add_child(child_node)
-                self.nodes[child_node.id] = child_node
-        return cnode
+                self.ends[cnode.idx] = self.ends[cnode.children[-1].idx]
 
-    def load_from_dict(self, jd, nid_ccount = 1, aa = False, gene = None):
-        global id_counter
-        id_counter = nid_ccount
-        cnode = self.root
-        self.__loader(jd, cnode, aa, gene)
+    def select_mutations(self, aa = False, gene = None):
+        '''
+        Set each node's mutation labels to those considered under the missense and gene settings, without reloading the tree.
+        '''
+        self.mask = self.mutation_table.mask(aa, gene)
+        #every node shares the same label strings, made only for the mutations selected.
+        mask = self.mask
+        labels = [self.mutation_table.label(mid) if mask[mid] else None for mid in range(len(self.mutation_table))]
+        mutation_ids, mutation_offsets = self.mutation_ids, self.mutation_offsets
+        for cnode in self.order:
+            cnode.mutations = [labels[mid] for mid in mutation_ids[mutation_offsets[cnode.idx]:mutation_offsets[cnode.idx+1]] if mask[mid]]
         return self
 
+    def node_at(self, idx):
+        return self.order[idx]
+
     def get_node(self, nid):
         return self.nodes.get(nid, None)
 
@@ -243,6 +791,290 @@ class Tree:
                 leaf_ids.append(n.id)
         return leaf_ids
 
+    def dists_to_root(self, node):
+        return dists_to_root(node)
+
+    def get_sum_and_count(self, rbfs, ignore = set()):
+        return get_sum_and_count(rbfs, ignore)
+
+    def remove_from_sum_and_count(self, sum_and_count_dict, node, stop_id):
+        return remove_from_sum_and_count(sum_and_count_dict, node, stop_id)
+
+    def __str__(self):
+        return self.root.__str__()
+
+class CompactNode:
+    '''
+    Lightweight view of a single CompactTree node exposing the same interface as TreeNode.
+    '''
+    __slots__ = ('tree','idx')
+
+    def __init__(self, tree, idx):
+        self.tree = tree
+        self.idx = idx
+
+    @property
+    def id(self):
+        return self.tree.node_id(self.idx)
+
+    @property
+    def mutations(self):
+        return self.tree.get_mutations(self.idx)
+
+    @property
+    def mutation_count(self):
+        #read straight from the counts array, since building the mutations list just to measure it dominates the tree passes.
+        return self.tree.mutation_counts[self.idx]
+
+    @property
+    def children(self):
+        return [CompactNode(self.tree, c) for c in self.tree.child_indices(self.idx)]
+
+    @property
+    def parent(self):
+        pidx = self.tree.parents[self.idx]
+        if pidx < 0:
+            return None
+        return CompactNode(self.tree, pidx)
+
+    def is_leaf(self):
+        return self.tree.ends[self.idx] == self.idx + 1
+
+    def __str__(self, level=0):
+        ret = "\t"*level+repr(self.id)+"\n"
+        for child in self.children:
+            ret += child.__str__(level+1)
+        return ret
+
+    def __eq__(self, other):
+        return isinstance(other, CompactNode) and other.tree is self.tree and other.idx == self.idx
+
+    def __hash__(self):
+        return hash(self.idx)
+
+    def __repr__(self):
+        return "\n".join(["id: "+self.id,"# of mutations: "+str(self.tree.mutation_counts[self.idx]),"# of children: "+str(len(self.tree.child_indices(self.idx)))])
+
+class CompactTree(TreeLoader, SubtreeIndex):
+    '''
+    Array-backed alternative to Tree for large inputs.
+
+    Nodes are stored in depth-first preorder, so a node's position is also the N in its node_N id. Each node keeps its parent position,
+    the end of its subtree range and a slice of ids into its MutationTable covering every mutation category; only named leaves keep
+    a string. The number of mutations each node has under the current missense and gene settings is kept in mutation_counts.
+    '''
+    FILE_MAGIC = b'GRITREE2'
+    FILE_ARRAYS = ('parents','ends','mutation_offsets','mutation_ids','leaf_prefix','bfs_positions')
+
+    def __init__(self):
+        self.parents = array('i')
+        self.ends = array('i')
+        self.mutation_offsets = array('q',[0])
+        self.mutation_ids = array('i')
+        self.mutation_table = MutationTable()
+        self.names = {}
+        self.name_index = {}
+
+    def add_node(self, idx, parent):
+        self.parents.append(-1 if parent == None else parent)
+
+    def end_node(self, idx, name, has_children):
+        if idx > 0 and name != None and not has_children:
+            self.names[idx] = name
+            self.name_index[name] = idx
+
+    def build_ends(self):
+        #parents always precede their children in preorder, so subtree sizes accumulate in a single reverse pass.
+        sizes = array('i',[1]) * len(self.parents)
+        for idx in range(len(self.parents)-1, 0, -1):
+            sizes[self.parents[idx]] += sizes[idx]
+        self.ends = array('i',[idx + sizes[idx] for idx in range(len(sizes))])
+
+    def select_mutations(self, aa = False, gene = None):
+        '''
+        Recount each node's mutations under the missense and gene settings, without reloading the tree.
+        '''
+        self.mask = self.mutation_table.mask(aa, gene)
+        #running totals of selected mutations at each offset turn every node's count into a single subtraction.
+        selected = array('q', itertools.accumulate(map(self.mask.__getitem__, self.mutation_ids), initial=0))
+        bounds = array('q', map(selected.__getitem__, self.mutation_offsets))
+        self.mutation_counts = array('i', map(int.__sub__, bounds[1:], bounds[:-1]))
+        return self
+
+    def save(self, path):
+        '''
+        Write the tree and its subtree index to a binary file that load_from_file can map back into memory without parsing.
+        '''
+        name_positions = array('i', self.names.keys())
+        arrays = [(name, getattr(self, name)) for name in self.FILE_ARRAYS] + [('name_positions', name_positions)]
+        arrays.append(('mutation_genes', self.mutation_table.gene_ids))
+        header = {"byteorder":sys.byteorder, "arrays":{}, "genes":self.mutation_table.genes, "mutations":self.mutation_table.changes, "names":list(self.names.values())}
+        offset = 0
+        for name, arr in arrays:
+            header["arrays"][name] = [arr.typecode, offset, len(arr)]
+            #keep every array 8-byte aligned so it can be cast in place once mapped.
+            offset += -(-len(arr) * arr.itemsize // 8) * 8
+        hbytes = json.dumps(header).encode('utf-8')
+        hbytes += b' ' * (-len(hbytes) % 8)
+        with open(path, 'wb') as of:
+            of.write(self.FILE_MAGIC)
+            of.write(len(hbytes).to_bytes(8, 'little'))
+            of.write(hbytes)
+            for name, arr in arrays:
+                of.write(arr.tobytes())
+                of.write(b'\0' * (-len(arr) * arr.itemsize % 8))
+
+    def load_from_file(self, path, aa = False, gene = None):
+        '''
+        Map a tree written by save into memory, considering mutations by the given missense and gene settings.
+        Arrays are read straight from the mapped file rather than copied.
+        '''
+        with open(path, 'rb') as inf:
+            mapped = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(self.FILE_MAGIC)] != self.FILE_MAGIC:
+            raise ValueError(f"{path} is not a saved tree!")
+        hstart = len(self.FILE_MAGIC) + 8
+        hlen = int.from_bytes(mapped[len(self.FILE_MAGIC):hstart], 'little')
+        header = json.loads(mapped[hstart:hstart+hlen])
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was saved on a machine with a different byte order!")
+        view = memoryview(mapped)[hstart+hlen:]
+        for name, (typecode, offset, length) in header["arrays"].items():
+            arr = view[offset:offset + length * array(typecode).itemsize].cast(typecode)
+            if name == 'name_positions':
+                name_positions = arr
+            elif name == 'mutation_genes':
+                gene_ids = arr
+            else:
+                setattr(self, name, arr)
+        self.mutation_table = MutationTable(header["genes"], header["mutations"], gene_ids)
+        self.names = dict(zip(name_positions, header["names"]))
+        self.name_index = dict(zip(header["names"], name_positions))
+        #the views keep the mapping open for as long as the tree is in use.
+        self.__mapped = mapped
+        return self.select_mutations(aa, gene)
+
+    @property
+    def root(self):
+        return CompactNode(self, 0)
+
+    def node_id(self, idx):
+        name = self.names.get(idx, None)
+        if name == None:
+            return 'node_' + str(idx)
+        return name
+
+    def get_mutations(self, idx):
+        return [self.mutation_table.label(mid) for mid in self.mutation_ids[self.mutation_offsets[idx]:self.mutation_offsets[idx+1]] if self.mask[mid]]
+
+    def child_indices(self, idx):
+        children = []
+        cidx = idx + 1
+        while cidx < self.ends[idx]:
+            children.append(cidx)
+            cidx = self.ends[cidx]
+        return children
+
+    def node_at(self, idx):
+        return CompactNode(self, idx)
+
+    def get_node(self, nid):
+        idx = self.name_index.get(nid, None)
+        if idx == None:
+            if not nid.startswith('node_') or not nid[5:].isdigit():
+                return None
+            idx = int(nid[5:])
+            if idx >= len(self.parents) or idx in self.names:
+                return None
+        return CompactNode(self, idx)
+
+    def parsimony_score(self):
+        return sum(self.mutation_counts)
+
+    def rsearch(self, node):
+        idx = node.idx
+        path = [self.node_id(idx)]
+        while self.parents[idx] >= 0:
+            idx = self.parents[idx]
+            path.append(self.node_id(idx))
+        return path
+
+    def breadth_first_expansion(self, cnode=None, reverse=False):
+        if cnode == None:
+            cnode = self.root
+        bfs = [cnode.idx]
+        i = 0
+        while i < len(bfs):
+            bfs.extend(self.child_indices(bfs[i]))
+            i += 1
+        if reverse:
+            bfs.reverse()
+        return [CompactNode(self, idx) for idx in bfs]
+
+    def get_leaves_ids(self, cnode=None):
+        return [n.id for n in self.breadth_first_expansion(cnode, reverse=True) if n.is_leaf()]
+
+    def dists_to_root(self, node):
+        #preorder visits each parent before its children, so one pass over the subtree range suffices.
+        start = node.idx
+        dists = array('q',[0]) * (self.ends[start] - start)
+        for idx in range(start+1, self.ends[start]):
+            dists[idx-start] = dists[self.parents[idx]-start] + self.mutation_counts[idx]
+        return {self.node_id(idx):dists[idx-start] for idx in range(start, self.ends[start])}
+
+    def get_sum_and_count(self, rbfs, ignore = set()):
+        #same computation as the module-level get_sum_and_count, but works on positions rather than node views.
+        values = {}
+        leaf_count = 0
+        for node in rbfs:
+            idx = node.idx
+            if self.ends[idx] == idx + 1:
+                leaf_count += 1
+                if self.node_id(idx) not in ignore:
+                    values[idx] = (self.mutation_counts[idx], 1)
+            else:
+                total_count = 0
+                total_sum = 0
+                cidx = idx + 1
+                while cidx < self.ends[idx]:
+                    sumtc = values.get(cidx, None)
+                    if sumtc != None:
+                        total_count += sumtc[1]
+                        total_sum += sumtc[0]
+                    cidx = self.ends[cidx]
+                if total_count > 0:
+                    values[idx] = (total_sum + self.mutation_counts[idx] * total_count, total_count)
+        return {self.node_id(idx):v for idx, v in values.items()}, leaf_count
+
+    def remove_from_sum_and_count(self, sum_and_count_dict, node, stop_id):
+        #same update as the module-level remove_from_sum_and_count, walking positions and the parents array instead of node views.
+        node_sum, node_count = sum_and_count_dict.get(node.id, (0,0))
+        changed = []
+        if node_count == 0:
+            return changed
+        idx = node.idx
+        end = self.ends[idx]
+        while idx < end:
+            nid = self.node_id(idx)
+            if sum_and_count_dict.pop(nid, None) != None:
+                changed.append(nid)
+                idx += 1
+            else:
+                idx = self.ends[idx]
+        idx = node.idx
+        nid = node.id
+        while nid != stop_id and self.parents[idx] >= 0:
+            idx = self.parents[idx]
+            nid = self.node_id(idx)
+            node_sum += self.mutation_counts[idx] * node_count
+            asum, acount = sum_and_count_dict[nid]
+            if acount == node_count:
+                del sum_and_count_dict[nid]
+            else:
+                sum_and_count_dict[nid] = (asum - node_sum, acount - node_count)
+            changed.append(nid)
+        return changed
+
     def __str__(self):
         return self.root.__str__()
 
@@ -250,86 +1082,645 @@ def n2a(n,b=string.ascii_uppercase):
    d, m = divmod(n,len(b))
    return n2a(d-1,b)+b[m] if d else b[m]
 
-def pipeline(ijd, ojson, floor=0, size=0, distinction=0, cutoff=1, missense=False, gene=None, maxlevels=0, labels=None, reportf=None):
-    if gene is not None and ',' in gene:
-        gene = gene.split(",")
-    t = Tree().load_from_dict(ijd['tree'], 1, missense, gene)
-    if t.parsimony_score() == 0:
-        raise Exception("Input tree contains no mutations! Did you select a gene that's not present, upload a misformatted JSON without mutation annotations, or upload an empty file?")
-    print(f"Loaded tree successfully; parsimony score {t.parsimony_score()}.",file=sys.stderr)
+def a2n(a,b=string.ascii_uppercase):
+    #inverse of n2a.
+    n = 0
+    for c in a:
+        n = n * len(b) + b.index(c) + 1
+    return n - 1
+
+def lineage_serial(ann):
+    if '.' in ann:
+        return int(ann.rsplit('.',1)[1])
+    return a2n(ann)
+
+def precompute_lineage(t, nid, stats=None):
+    """
+    Compute the parameter-independent inputs to subdivide_lineage for one lineage root, so that they can be shared between runs.
+    If stats is given, the time taken by each pass is added to it.
+    """
+    pnode = t.get_node(nid)
+    #reverse preorder keeps children ahead of their parents; candidate ties are still broken in reverse breadth-first order.
+    rpre = t.subtree(pnode, reverse=True)
+    if stats != None:
+        start = time.perf_counter()
+    dist_root = t.dists_to_root(pnode)
+    if stats != None:
+        stats['dists_seconds'] = time.perf_counter() - start
+        start = time.perf_counter()
+    scdict, leaf_count = t.get_sum_and_count(rpre)
+    if stats != None:
+        stats['sum_and_count_seconds'] = time.perf_counter() - start
+    return rpre, dist_root, scdict, leaf_count
+
+def subdivide_lineage(t, ann, nid, floor=0, size=0, distinction=0, cutoff=1, used_nodes=None, precomputed=None, existing=None, serial=0, stats=None):
+    """
+    Choose sublineages of one lineage by repeatedly taking the candidate with the highest GRI.
+
+    Stops once the cutoff proportion of the lineage's samples are labeled or no candidate scores above floor. Ancestors of each chosen
+    node are added to used_nodes and can't be chosen again. precomputed optionally maps lineage root ids to the output of precompute_lineage.
+    existing optionally lists (name, node id) pairs of sublineages kept from an earlier run. These are taken as already chosen, only the
+    part of the lineage outside them is searched, and new sublineages are numbered from serial.
+    If stats is given, the number of nodes visited and candidate evaluations and the time spent on each pass are added to it.
+    Returns the chosen (name, node id) pairs in order, and whether the cutoff was reached.
+    """
+    if used_nodes == None:
+        used_nodes = set()
+    chosen = []
+    pnode = t.get_node(nid) #needs the node object, not just the name
+    if t.count_leaves(pnode) == 0:
+        return chosen, False
+    labeled_count = 0
+    if existing:
+        #every sample below a kept sublineage is already labeled, so nothing inside one can score and it need not be visited at all.
+        region = t.subtree_outside(pnode, [t.get_node(eid) for _, eid in existing])
+        if stats != None:
+            start = time.perf_counter()
+        dist_root = dists_in_region(region)
+        if stats != None:
+            stats['dists_seconds'] = time.perf_counter() - start
+            start = time.perf_counter()
+        region.reverse()
+        rpre = region
+        scdict, _ = t.get_sum_and_count(rpre)
+        if stats != None:
+            stats['sum_and_count_seconds'] = time.perf_counter() - start
+        leaf_count = t.count_leaves(pnode)
+        for name, eid in existing:
+            enode = t.get_node(eid)
+            used_nodes.update(t.rsearch(enode))
+            chosen.append((name, eid))
+            labeled_count += t.count_leaves(enode)
+        if labeled_count >= leaf_count * cutoff:
+            return chosen, True
+    elif precomputed != None and nid in precomputed:
+        rpre, dist_root, scdict, leaf_count = precomputed[nid]
+        #the sums and counts are updated as lineages are chosen, so work on a copy.
+        scdict = dict(scdict)
+    else:
+        rpre, dist_root, scdict, leaf_count = precompute_lineage(t, nid, stats)
+    if stats != None:
+        stats['nodes'] = len(rpre)
+        start = time.perf_counter()
+    candidates = CandidateHeap(nid, rpre, scdict, dist_root, size, distinction, used_nodes, t.reverse_bfs_rank)
+    reached_cutoff = False
+    while True:
+        best_score, best_node = candidates.best()
+        if best_score <= floor:
+            break
+        if ann == "Root":
+            newname = n2a(serial)
+        else:
+            newname = ann + "." + str(serial)
+        ancestry = t.rsearch(best_node)
+        for anc in ancestry:
+            used_nodes.add(anc)
+        chosen.append((newname, best_node.id))
+        #the lineage takes every sample below it that was still unlabeled.
+        labeled_count += scdict[best_node.id][1]
+        candidates.update(t.remove_from_sum_and_count(scdict, best_node, nid) + ancestry)
+        if labeled_count >= leaf_count * cutoff:
+            reached_cutoff = True
+            break
+        serial += 1
+    if stats != None:
+        stats['selection_seconds'] = time.perf_counter() - start
+        stats['evaluations'] = candidates.evaluations
+        stats['chosen'] = len(chosen)
+    return chosen, reached_cutoff
+
+def subdivide_lineage_profiled(t, *args, **kwargs):
+    """
+    Run subdivide_lineage, also returning the stats it collects along with its total time.
+    """
+    stats = {}
+    start = time.perf_counter()
+    chosen, reached_cutoff = subdivide_lineage(t, *args, stats=stats, **kwargs)
+    stats['seconds'] = time.perf_counter() - start
+    return chosen, reached_cutoff, stats
+
+worker_tree = None
+worker_precomputed = None
+
+def set_worker_tree(t, precomputed=None):
+    global worker_tree, worker_precomputed
+    worker_tree = t
+    worker_precomputed = precomputed
+
+def subdivide_in_worker(args):
+    return subdivide_lineage(worker_tree, *args)
+
+def subdivide_profiled_in_worker(args):
+    return subdivide_lineage_profiled(worker_tree, *args)
+
+def worker_pool(jobs, t, precomputed=None):
+    #forked workers inherit the loaded tree instead of having it pickled for each of them.
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    return ProcessPoolExecutor(jobs, mp_context=context, initializer=set_worker_tree, initargs=(t, precomputed))
+
+def annotate_tree(t, floor=0, size=0, distinction=0, cutoff=1, maxlevels=0, jobs=1, precomputed=None, verbose=True, progress=None, profiler=None, previous=None):
+    """
+    Generate the full hierarchy of lineage labels for a loaded tree.
+
+    Lineages on the same level are subdivided in a pool of jobs worker processes when jobs is more than 1. Their subtrees are disjoint,
+    so results are merged back in the same order as a serial run and the output is identical. progress, if given, is called with a
+    message as each level is completed. profiler, if given, is a profiling.Profiler that records each level and lineage subdivided.
+    previous, if given, is a PreviousAnnotation whose lineages are kept rather than chosen again.
+    Returns the lineage root of each annotation, the label of every labeled node and the number of levels generated.
+    """
     annotes = {'Root':t.root.id}
     outer_annotes = annotes
     level = 1
-    leaf_names = set(t.get_leaves_ids())
     all_labels = {}
-    while True:
-        new_annotes = {}
-        used_nodes = set()
-        for ann,nid in outer_annotes.items():
-            serial = 0
-            rbfs = t.breadth_first_expansion(t.get_node(nid), True)
-            parent_leaf_count = len([n for n in rbfs if n.is_leaf()])
-            if parent_leaf_count == 0:
-                continue
-            labeled = set()
-            dist_root = dists_to_root(t.get_node(nid)) #needs the node object, not just the name
-            while True:
-                scdict, leaf_count = get_sum_and_count(rbfs, ignore = labeled)
-                best_score, best_node = evaluate_lineage(t, dist_root, nid, rbfs, scdict, size, distinction, used_nodes)
-                if best_score <= floor:
-                    break
-                if ann == "Root":
-                    newname = n2a(serial)
+    pool = None
+    if jobs > 1:
+        pool = worker_pool(jobs, t)
+    try:
+        while True:
+            level_start = time.perf_counter()
+            new_annotes = {}
+            used_nodes = set()
+            #each lineage to subdivide, with the sublineages it keeps from an earlier run and the serial its new ones are numbered from.
+            tasks = []
+            for ann, nid in outer_annotes.items():
+                if previous == None:
+                    tasks.append((ann, nid, None, 0))
+                elif not previous.unchanged(t, ann, nid):
+                    tasks.append((ann, nid, previous.existing.get(ann, []), previous.serials.get(ann, 0)))
+            if pool != None and len(tasks) > 1:
+                work = [(ann, nid, floor, size, distinction, cutoff, None, None, existing, serial) for ann, nid, existing, serial in tasks]
+                results = pool.map(subdivide_in_worker if profiler == None else subdivide_profiled_in_worker, work, chunksize=max(1, len(work) // (jobs * 4)))
+            else:
+                subdivide = subdivide_lineage if profiler == None else subdivide_lineage_profiled
+                results = (subdivide(t, ann, nid, floor, size, distinction, cutoff, used_nodes, precomputed, existing, serial) for ann, nid, existing, serial in tasks)
+            results = iter(results)
+            subdivided = set(task[0] for task in tasks)
+            for ann in outer_annotes:
+                if ann not in subdivided:
+                    #unchanged since the earlier run, so its sublineages are kept as they were.
+                    chosen, reached_cutoff = previous.existing.get(ann, []), True
                 else:
-                    newname = ann + "." + str(serial)
-                for anc in t.rsearch(best_node):
-                    used_nodes.add(anc)
-                new_annotes[newname] = best_node.id
-                desc = t.breadth_first_expansion(best_node)
-                for l in desc:
-                    #overrwite an existing higher-level label if it exists
-                    #because each lineage label name contains its ancestral lineage labels as well.
-                    all_labels[l.id] = newname
-                    if l.is_leaf():
-                        labeled.add(l.id)
-                if len(labeled) >= leaf_count * cutoff:
+                    result = next(results)
+                    chosen, reached_cutoff = result[0], result[1]
+                    if profiler != None:
+                        profiler.record_lineage(level, ann, result[2])
+                for i, (newname, best_id) in enumerate(chosen):
+                    new_annotes[newname] = best_id
+                    for l in t.subtree(t.get_node(best_id)):
+                        #overrwite an existing higher-level label if it exists
+                        #because each lineage label name contains its ancestral lineage labels as well.
+                        all_labels[l.id] = newname
+                    if verbose and (i < len(chosen) - 1 or not reached_cutoff) and (previous == None or newname not in previous.kept):
+                        print(f"Annotation {newname} generated for node {best_id}.")
+            if profiler != None:
+                profiler.record_level(level, len(outer_annotes), len(new_annotes), time.perf_counter() - level_start)
+            if progress != None:
+                progress(f"Generated {len(new_annotes)} lineages on level {level}.")
+            if len(new_annotes) == 0:
+                break
+            else:
+                annotes.update(new_annotes)
+                outer_annotes = new_annotes
+                if maxlevels > 0:
+                    if level >= maxlevels:
+                        break
+                level += 1
+    finally:
+        if pool != None:
+            pool.shutdown()
+    return annotes, all_labels, level
+
+def read_previous_annotation(reportf, labels):
+    """
+    Read the report and labels tables written by an earlier run.
+
+    Returns the parent, signature mutations and number of descendents of each lineage in report order, and the samples labeled with each
+    lineage or any of its sublineages.
+    """
+    lineages = {}
+    with open(reportf) as inf:
+        next(inf)
+        for line in inf:
+            if line.strip() == "":
+                continue
+            ann, parent, num_desc, mutations = line.rstrip("\n").split("\t")
+            lineages[ann] = (parent, mutations.split(",") if mutations != "" else [], int(num_desc))
+    samples = {}
+    with open(labels) as inf:
+        next(inf)
+        for line in inf:
+            if line.strip() == "":
+                continue
+            sample, lineage = line.rstrip("\n").split("\t")
+            parts = lineage.split(".")
+            for i in range(1, len(parts) + 1):
+                samples.setdefault(".".join(parts[:i]), []).append(sample)
+    return lineages, samples
+
+def match_previous_lineages(t, lineages, samples, max_samples=50):
+    """
+    Find the root of each earlier lineage in an updated tree.
+
+    A lineage is matched below the match of its parent lineage, at a node whose mutations back to that parent are exactly the signature
+    mutations in the earlier report. Candidates are found by walking up from up to max_samples of the lineage's earlier samples, and the one
+    reached from the most samples wins; ties, as along a run of branches without mutations, go to the node whose number of descendents is
+    closest to the earlier one. Lineages that can't be matched, or whose parent wasn't, are dropped.
+    Returns the matched node id of each kept lineage, parents before children.
+    """
+    kept = {'Root':t.root.id}
+    sibling_ranges = {}
+    for ann, (parent, signature, num_desc) in lineages.items():
+        if ann == 'Root':
+            continue
+        if parent not in kept:
+            print(f"WARNING: lineage {ann} was dropped along with its parent lineage {parent}.",file=sys.stderr)
+            continue
+        pnode = t.get_node(kept[parent])
+        start, end = t.subtree_range(pnode)
+        lsamples = samples.get(ann, [])
+        votes = {}
+        for sample in lsamples[::max(1, len(lsamples) // max_samples)]:
+            snode = t.get_node(sample)
+            if snode == None or not start < snode.idx < end:
+                continue
+            path = []
+            while snode.idx != pnode.idx:
+                path.append(snode)
+                snode = snode.parent
+            #the signature lists mutations from the lineage root upwards, so walking back down consumes it from the end.
+            remaining = len(signature)
+            for node in reversed(path):
+                mutations = node.mutations
+                if len(mutations) > remaining or signature[remaining-len(mutations):remaining] != mutations:
                     break
-                serial += 1
-                print(f"Annotation {newname} generated for node {best_node.id}.")
-        if len(new_annotes) == 0:
-            break
-        else:
-            annotes.update(new_annotes)
-            outer_annotes = new_annotes
-            if maxlevels > 0:
-                if level >= maxlevels:
+                remaining -= len(mutations)
+                if remaining == 0:
+                    votes[node.idx] = votes.get(node.idx, 0) + 1
+        match = None
+        for idx in sorted(votes, key=lambda idx: (-votes[idx], abs(t.leaf_prefix[t.ends[idx]] - t.leaf_prefix[idx] - num_desc), idx)):
+            overlaps = False
+            for sstart, send in sibling_ranges.get(parent, []):
+                if sstart <= idx < send or idx <= sstart < t.ends[idx]:
+                    overlaps = True
                     break
-            level += 1
-    leaf_labels = {k:v for k,v in all_labels.items() if k in leaf_names}
-    print(f"Total samples labeled: {len(leaf_labels)}\nTotal labels generated: {len(annotes)}\nTotal levels generated: {level}")
-    if labels != None:
-        with open(labels,'w+') as of:
-            print("sample","lineage",sep='\t',file=of)
-            for k,v in leaf_labels.items():
-                print(k,v,sep='\t',file=of)
+            if not overlaps:
+                match = t.node_at(idx)
+                break
+        if match == None:
+            print(f"WARNING: lineage {ann} could not be matched in the updated tree and was dropped.",file=sys.stderr)
+            continue
+        kept[ann] = match.id
+        sibling_ranges.setdefault(parent, []).append(t.subtree_range(match))
+    return kept
+
+class PreviousAnnotation:
+    '''
+    The lineages of an earlier run, read with read_previous_annotation, matched to a tree that has since gained or lost samples.
+
+    Passed to annotate_tree, earlier lineages keep their names wherever they can be matched with match_previous_lineages. Lineages whose
+    number of samples is unchanged keep their earlier sublineages as they are; the rest are searched again for new sublineages only outside
+    their kept ones, with new names numbered after the earlier ones.
+    '''
+    def __init__(self, t, lineages, samples):
+        self.lineages = lineages
+        self.kept = match_previous_lineages(t, lineages, samples)
+        self.existing = {}
+        self.serials = {}
+        self.children = {}
+        for ann, (parent, _, _) in lineages.items():
+            if ann == 'Root':
+                continue
+            #never reuse the name of an earlier lineage, even one that was dropped.
+            self.serials[parent] = max(self.serials.get(parent, 0), lineage_serial(ann) + 1)
+            self.children[parent] = self.children.get(parent, 0) + 1
+            if ann in self.kept:
+                self.existing.setdefault(parent, []).append((ann, self.kept[ann]))
+
+    def unchanged(self, t, ann, nid):
+        """
+        Whether the lineage ann, rooted at nid, has the same samples and sublineages as before and needn't be subdivided again.
+        """
+        return ann in self.kept and t.count_leaves(t.get_node(nid)) == self.lineages[ann][2] and len(self.existing.get(ann, [])) == self.children.get(ann, 0)
+
+def read_input(path):
+    """
+    Load an input JSON, or return path unchanged so that the tree is streamed from it if it is nested too deeply for json.load.
+    """
+    try:
+        with open(path) as inf:
+            return json.load(inf)
+    except RecursionError:
+        print(f"WARNING: {path} is nested too deeply to load at once; streaming it instead.",file=sys.stderr)
+        return path
+
+def load_tree(ijd, missense=False, gene=None, compact=False, cache_dir=None, cache_size=1024):
+    """
+    Load the tree to annotate from an Auspice JSON dictionary, or stream it from a filename or open file without loading the whole document.
+
+    If cache_dir is set, trees loaded from files are kept there as CompactTree binaries keyed by the input's content, and later loads of
+    the same input map the cached tree instead, under any missense and gene settings. An empty cache_dir uses a directory next to the input.
+    The cache is kept under cache_size megabytes.
+    """
+    if cache_dir != None and type(ijd) != dict:
+        if cache_dir == "":
+            cache_dir = tree_cache.default_cache_dir(ijd)
+        #every mutation category is cached, so one entry serves any missense and gene settings.
+        key = tree_cache.cache_key(ijd, CompactTree.FILE_MAGIC.decode())
+        path = tree_cache.cache_path(cache_dir, key)
+        if os.path.exists(path):
+            try:
+                t = CompactTree().load_from_file(path, missense, gene)
+            except (OSError, ValueError) as e:
+                print(f"WARNING: could not read cached tree {path}: {e}",file=sys.stderr)
+            else:
+                tree_cache.touch(path)
+                print(f"Loaded cached tree {path}.",file=sys.stderr)
+                return t
+        t = load_tree(ijd, missense, gene, True)
+        tree_cache.store(cache_dir, key, t.save, cache_size * 1024 * 1024)
+        return t
+    t = CompactTree() if compact else Tree()
+    if type(ijd) == dict:
+        return t.load_from_dict(ijd['tree'], 1, missense, gene)
+    inf = open_text(ijd)
+    try:
+        t.load_from_stream(inf, missense, gene)
+    finally:
+        if inf is not ijd:
+            if type(ijd) == str:
+                inf.close()
+            else:
+                #leave the caller's file open so that it can be read again for the output.
+                inf.detach()
+    return t
+
+def prepare_tree(ijd, missense=False, gene=None, compact=False, cache_dir=None, cache_size=1024):
+    """
+    Load a tree with load_tree and check that it has mutations to annotate with. gene may be a ',' delimited list of genes.
+    """
+    if gene is not None and ',' in gene:
+        gene = gene.split(",")
+    t = load_tree(ijd, missense, gene, compact, cache_dir, cache_size)
+    if t.parsimony_score() == 0:
+        raise Exception("Input tree contains no mutations! Did you select a gene that's not present, upload a misformatted JSON without mutation annotations, or upload an empty file?")
+    print(f"Loaded tree successfully; parsimony score {t.parsimony_score()}.",file=sys.stderr)
+    return t
+
+def get_leaf_labels(t, annotes, all_labels):
+    #every labeled sample first gets its label at the top level, so list samples by top-level lineage and then in breadth-first order.
+    leaf_labels = {}
+    for ann, nid in annotes.items():
+        if ann != 'Root' and '.' not in ann:
+            leaves = [n for n in t.subtree(t.get_node(nid)) if n.is_leaf()]
+            leaves.sort(key=lambda n: t.bfs_positions[n.idx])
+            for n in leaves:
+                leaf_labels[n.id] = all_labels[n.id]
+    return leaf_labels
+
+def write_labels(leaf_labels, labels):
+    with open(labels,'w+') as of:
+        print("sample","lineage",sep='\t',file=of)
+        for k,v in leaf_labels.items():
+            print(k,v,sep='\t',file=of)
+
+def get_lineage_roots(annotes):
     annd = {}
     for annote, nid in annotes.items():
         if nid not in annd:
             annd[nid] = [annote]
         else:
             annd[nid].append(annote)
-    njd = update_json(ijd, all_labels, annd, level)
-    with open(ojson,'w+') as of:
-        json.dump(njd,of)
+    return annd
+
+def pipeline(ijd, ojson, floor=0, size=0, distinction=0, cutoff=1, missense=False, gene=None, maxlevels=0, labels=None, reportf=None, compact=False, compress=False, jobs=1, cache_dir=None, cache_size=1024, progress=None, previous=None, profiler=None):
+    """
+    Load a tree, annotate it with lineage labels and write the annotated JSON along with optional labels and report tables.
+
+    progress, if given, is called with a short message as each stage finishes. previous, if given, is the (report, labels) pair of files
+    written by an earlier run on an older version of the tree, whose lineage names are then kept and extended rather than regenerated.
+    profiler, if given, is a profiling.Profiler that records the time and memory of each stage and the work done for each lineage.
+    """
+    with profiling.stage(profiler, "load"):
+        t = prepare_tree(ijd, missense, gene, compact, cache_dir, cache_size)
+    if progress != None:
+        progress(f"Loaded tree with parsimony score {t.parsimony_score()}.")
+    with profiling.stage(profiler, "annotate"):
+        if previous != None:
+            lineages, samples = read_previous_annotation(*previous)
+            annotes, all_labels, level = annotate_tree(t, floor, size, distinction, cutoff, maxlevels, jobs, progress=progress, profiler=profiler, previous=PreviousAnnotation(t, lineages, samples))
+        else:
+            annotes, all_labels, level = annotate_tree(t, floor, size, distinction, cutoff, maxlevels, jobs, progress=progress, profiler=profiler)
+    with profiling.stage(profiler, "labels"):
+        leaf_labels = get_leaf_labels(t, annotes, all_labels)
+        print(f"Total samples labeled: {len(leaf_labels)}\nTotal labels generated: {len(annotes)}\nTotal levels generated: {level}")
+        if labels != None:
+            write_labels(leaf_labels, labels)
+    annd = get_lineage_roots(annotes)
+    with profiling.stage(profiler, "write_json"):
+        write_annotated_json(ijd, ojson, all_labels, annd, level, t, compress)
+    if progress != None:
+        progress("Wrote the annotated JSON.")
     if reportf != None:
-        generate_report(t, annotes, annd, reportf)
-    
+        with profiling.stage(profiler, "report"):
+            generate_report(t, annotes, annd, reportf)
+
+SWEEP_PARAMETERS = {'floor':0, 'size':0, 'distinction':0, 'cutoff':1, 'maxlevels':0}
+
+def run_sweep_combination(t, params, outprefix=None, precomputed=None):
+    """
+    Annotate a tree with one combination of sweep parameters and summarize the result, optionally writing its labels and report.
+    """
+    start = time.perf_counter()
+    annotes, all_labels, level = annotate_tree(t, params['floor'], params['size'], params['distinction'], params['cutoff'], params['maxlevels'], precomputed=precomputed, verbose=False)
+    leaf_labels = get_leaf_labels(t, annotes, all_labels)
+    if outprefix != None:
+        write_labels(leaf_labels, outprefix + ".labels.tsv")
+        generate_report(t, annotes, get_lineage_roots(annotes), outprefix + ".report.tsv")
+    per_level = []
+    for ann in annotes:
+        if ann != 'Root':
+            depth = ann.count('.')
+            per_level.extend([0] * (depth + 1 - len(per_level)))
+            per_level[depth] += 1
+    return dict(params, lineages=len(annotes) - 1, per_level=per_level, samples=len(leaf_labels), seconds=time.perf_counter() - start)
+
+def sweep_in_worker(args):
+    return run_sweep_combination(worker_tree, *args, precomputed=worker_precomputed)
+
+def pipeline_sweep(ijd, summary, grid, missense=False, gene=None, outdir=None, compact=False, jobs=1, cache_dir=None, cache_size=1024):
+    """
+    Annotate one tree under every combination of the parameter values in grid, loading and precomputing the tree only once.
+
+    grid maps any of floor, size, distinction, cutoff and maxlevels to a list of values; the rest keep their pipeline defaults.
+    Combinations are run in a pool of jobs worker processes when jobs is more than 1. A TSV with lineages per level, samples labeled and
+    runtime for each combination is written to summary, and each combination's labels and report go to outdir if it is given.
+    Returns the summary rows.
+    """
+    for p in grid:
+        if p not in SWEEP_PARAMETERS:
+            raise Exception(f"Unknown sweep parameter {p}!")
+    combinations = [dict(zip(SWEEP_PARAMETERS.keys(), values)) for values in itertools.product(*[grid.get(p, [d]) for p, d in SWEEP_PARAMETERS.items()])]
+    t = prepare_tree(ijd, missense, gene, compact, cache_dir, cache_size)
+    #the root's distances, sums and counts don't depend on any sweep parameter.
+    precomputed = {t.root.id:precompute_lineage(t, t.root.id)}
+    if outdir != None:
+        os.makedirs(outdir, exist_ok=True)
+    tasks = [(params, os.path.join(outdir, "combination_" + str(i)) if outdir != None else None) for i, params in enumerate(combinations)]
+    if jobs > 1 and len(tasks) > 1:
+        with worker_pool(jobs, t, precomputed) as pool:
+            rows = list(pool.map(sweep_in_worker, tasks))
+    else:
+        rows = [run_sweep_combination(t, params, outprefix, precomputed) for params, outprefix in tasks]
+    with open(summary,'w+') as of:
+        print('Combination','Floor','Size','Distinction','Cutoff','Max Levels','Lineages','Lineages Per Level','Samples Labeled','Seconds',sep='\t',file=of)
+        for i, r in enumerate(rows):
+            print(i, r['floor'], r['size'], r['distinction'], r['cutoff'], r['maxlevels'], r['lineages'], ','.join(map(str, r['per_level'])), r['samples'], round(r['seconds'],3), sep='\t', file=of)
+    return rows
+
+def parse_flag(value):
+    return value.strip().lower() in ('1','true','yes','y')
+
+#manifest columns that may override a batch parameter, with the pipeline argument each sets and how to read it.
+BATCH_OVERRIDES = {'floor':('floor',int), 'size':('size',int), 'distinction':('distinction',int), 'cutoff':('cutoff',float),
+                   'levels':('maxlevels',int), 'missense':('missense',parse_flag), 'gene':('gene',str)}
+
+def read_manifest(path):
+    """
+    Read a batch manifest, returning each input path, relative to the manifest if not absolute, with its parameter overrides.
+    """
+    entries = []
+    with open(path) as inf:
+        columns = inf.readline().rstrip("\n").split("\t")
+        if 'input' not in columns:
+            raise Exception(f"Manifest {path} has no input column!")
+        for c in columns:
+            if c != 'input' and c not in BATCH_OVERRIDES:
+                raise Exception(f"Unknown manifest column {c}!")
+        for line in inf:
+            if line.strip() == "":
+                continue
+            row = dict(zip(columns, line.rstrip("\n").split("\t")))
+            overrides = {}
+            for c, value in row.items():
+                if c != 'input' and value != "":
+                    name, cast = BATCH_OVERRIDES[c]
+                    overrides[name] = cast(value)
+            entries.append((os.path.normpath(os.path.join(os.path.dirname(path), row['input'])), overrides))
+    return entries
+
+def run_batch_input(ijd, outprefix, params):
+    """
+    Run pipeline on one batch input, sending its console output to outprefix.log. Returns an error message if it fails, or None.
+    """
+    with open(outprefix + ".log",'w+') as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            if not params['stream'] and params['cache_dir'] == None:
+                ijd = read_input(ijd)
+            ojson = outprefix + ".annotated.json" + (".gz" if params['compress'] else "")
+            pipeline(ijd, ojson, params['floor'], params['size'], params['distinction'], params['cutoff'], params['missense'], params['gene'],
+                     params['maxlevels'], outprefix + ".labels.tsv", outprefix + ".report.tsv", params['compact'], params['compress'],
+                     cache_dir=params['cache_dir'], cache_size=params['cache_size'])
+        except Exception as e:
+            print(f"ERROR: {e}")
+            return str(e)
+    return None
+
+def batch_in_worker(args):
+    start = time.perf_counter()
+    error = run_batch_input(*args)
+    return error, time.perf_counter() - start
+
+def pipeline_batch(inputs, outdir, defaults, jobs=1, max_large=1, large_mb=100):
+    """
+    Annotate many inputs, each with the pipeline parameters in defaults updated by its own overrides, writing outputs to outdir.
+
+    inputs lists (path, overrides) pairs. Inputs are run in a pool of jobs worker processes when jobs is more than 1, with no more than
+    max_large inputs of at least large_mb megabytes running at once so that only that many large trees are ever loaded together. Each large
+    input runs in a process of its own that exits when it finishes, since pool workers keep the memory of what they have loaded.
+    A failing input is logged and skipped. A TSV with the status and runtime of each input is written to outdir/batch_summary.tsv.
+    Returns the summary rows.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    tasks = []
+    used = set()
+    for path, overrides in inputs:
+        stem = os.path.basename(path)
+        if stem.endswith(".json"):
+            stem = stem[:-len(".json")]
+        #inputs from different directories can share a name.
+        name = stem
+        i = 1
+        while name in used:
+            name = stem + "_" + str(i)
+            i += 1
+        used.add(name)
+        large = os.path.exists(path) and os.path.getsize(path) >= large_mb * 1e6
+        tasks.append((path, os.path.join(outdir, name), dict(defaults, **overrides), large))
+    results = {}
+    if jobs > 1 and len(tasks) > 1:
+        pending = list(range(len(tasks)))
+        running = {}
+        #large inputs each get a pool with a single worker, shut down as soon as the input is done.
+        large_pools = {}
+        with ProcessPoolExecutor(jobs) as pool:
+            try:
+                while pending or running:
+                    #start every small input and as many large ones as allowed, in order.
+                    large_running = len(large_pools)
+                    for i in list(pending):
+                        if len(running) >= jobs:
+                            break
+                        if tasks[i][3]:
+                            if large_running >= max_large:
+                                continue
+                            large_running += 1
+                            large_pools[i] = ProcessPoolExecutor(1)
+                            future = large_pools[i].submit(batch_in_worker, tasks[i][:3])
+                        else:
+                            future = pool.submit(batch_in_worker, tasks[i][:3])
+                        pending.remove(i)
+                        running[future] = i
+                    if len(running) == 0:
+                        #waiting on nothing returns at once, so this would spin forever.
+                        raise Exception(f"No input can be started with max_large {max_large}!")
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        i = running.pop(future)
+                        if i in large_pools:
+                            large_pools.pop(i).shutdown()
+                        try:
+                            results[i] = future.result()
+                        except Exception as e:
+                            #the worker itself died, e.g. killed for running out of memory.
+                            results[i] = (f"worker failed: {e!r}", 0)
+                        print(f"Finished {tasks[i][0]}" + (f" with error: {results[i][0]}" if results[i][0] != None else "."),file=sys.stderr)
+            finally:
+                for large_pool in large_pools.values():
+                    large_pool.shutdown(cancel_futures=True)
+    else:
+        for i, task in enumerate(tasks):
+            results[i] = batch_in_worker(task[:3])
+            print(f"Finished {task[0]}" + (f" with error: {results[i][0]}" if results[i][0] != None else "."),file=sys.stderr)
+    rows = []
+    with open(os.path.join(outdir, "batch_summary.tsv"),'w+') as of:
+        print('Input','Output Prefix','Status','Seconds','Error',sep='\t',file=of)
+        for i, (path, outprefix, _, _) in enumerate(tasks):
+            error, seconds = results[i]
+            rows.append({'input':path, 'outprefix':outprefix, 'error':error, 'seconds':seconds})
+            print(path, outprefix, "failed" if error != None else "ok", round(seconds,3), error if error != None else "", sep='\t', file=of)
+    failed = sum(1 for r in rows if r['error'] != None)
+    print(f"Annotated {len(rows) - failed} of {len(rows)} inputs.",file=sys.stderr)
+    return rows
+
 def generate_report(t, annotes, annd, outf):
     with open(outf,'w+') as of:
         print('Lineage Annotation','Parent Lineage','Number of Descendents','Signature Mutations',sep='\t',file=of)
         for ann, nid in annotes.items():
             qnode = t.get_node(nid)
-            num_desc = len(t.get_leaves_ids(qnode))
+            num_desc = t.count_leaves(qnode)
             ancestry = t.rsearch(qnode)
             mutations = []
             parent = None
@@ -339,14 +1730,56 @@ def generate_report(t, annotes, annd, outf):
                     break
                 else:
                     a = t.get_node(aid)
-                    mutations.extend(a.mutations)
-            print(ann, parent, num_desc, ','.join(mutations), sep='\t', file=of)
+                    mutations.extend(t.get_mutation_ids(a))
+            #signatures are carried as ids and only turned into names for output.
+            print(ann, parent, num_desc, ','.join([t.mutation_table.label(mid) for mid in mutations]), sep='\t', file=of)
+
+def sweep_main(argv):
+    args = sweep_argparser(argv)
+    grid = {'floor':args.floor, 'size':args.size, 'distinction':args.distinction, 'cutoff':args.cutoff, 'maxlevels':args.levels}
+    pipeline_sweep(args.input, args.output, grid, args.missense, args.gene, args.outdir, args.compact, args.jobs, args.cache, args.cache_size)
+
+def batch_main(argv):
+    args = batch_argparser(argv)
+    inputs = []
+    for pattern in args.input:
+        matches = sorted(glob.glob(pattern))
+        if len(matches) == 0:
+            print(f"WARNING: no inputs match {pattern}.",file=sys.stderr)
+        inputs.extend((path, {}) for path in matches)
+    if args.manifest != None:
+        inputs.extend(read_manifest(args.manifest))
+    if len(inputs) == 0:
+        raise Exception("No inputs to annotate!")
+    defaults = {'floor':args.floor, 'size':args.size, 'distinction':args.distinction, 'cutoff':args.cutoff, 'maxlevels':args.levels,
+                'missense':args.missense, 'gene':args.gene, 'compact':args.compact, 'compress':args.gzip, 'stream':args.stream,
+                'cache_dir':args.cache, 'cache_size':args.cache_size}
+    rows = pipeline_batch(inputs, args.outdir, defaults, args.jobs, args.max_large, args.large_mb)
+    if any(r['error'] != None for r in rows):
+        sys.exit(1)
 
 def main():
+    if sys.argv[1:2] == ['sweep']:
+        sweep_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['batch']:
+        batch_main(sys.argv[2:])
+        return
     args = argparser()
-    with open(args.input) as inf:
-        ijd = json.load(inf)
-    pipeline(ijd,args.output,args.floor,args.size,args.distinction,args.cutoff,args.missense,args.gene,args.levels,args.labels,args.report)
+    previous = None
+    if args.previous_report != None:
+        previous = (args.previous_report, args.previous_labels)
+    profiler = None
+    if args.profile != None or args.profile_dir != None:
+        profiler = profiling.Profiler(args.profile_dir)
+    with profiling.stage(profiler, "read_json"):
+        if args.stream or args.cache != None:
+            ijd = args.input
+        else:
+            ijd = read_input(args.input)
+    pipeline(ijd,args.output,args.floor,args.size,args.distinction,args.cutoff,args.missense,args.gene,args.levels,args.labels,args.report,args.compact,args.gzip,args.jobs,args.cache,args.cache_size,previous=previous,profiler=profiler)
+    if args.profile != None:
+        profiler.write(args.profile)
 
 if __name__ == "__main__":
     main()
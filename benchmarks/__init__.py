@@ -0,0 +1,3 @@
+'''
+Benchmarks for the lineage annotation pipeline. generate builds synthetic Auspice v2 trees and run times each pipeline stage on them.
+'''
@@ -0,0 +1,63 @@
+'''
+Compare memory use and throughput of the object-based Tree against the array-based CompactTree on an Auspice v2 JSON.
+'''
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from annotate_json import Tree, CompactTree, read_input
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Compare the memory use and throughput of the Tree and CompactTree backends.")
+    parser.add_argument("-i","--input",help="Name of an input JSON.",required=True)
+    parser.add_argument("-m","--missense",action='store_true',default=False,help="Use to only consider amino-acid altering mutations.")
+    parser.add_argument("-g","--gene",default=None,help="Only consider missense mutations within specific genes, ',' delimited.")
+    return parser.parse_args()
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def compare_backend(tree_class, ijd, missense=False, gene=None):
+    tracemalloc.start()
+    if type(ijd) == dict:
+        t, load_time = timed(tree_class().load_from_dict, ijd['tree'], 1, missense, gene)
+    else:
+        #too deeply nested for json.load, so both backends stream the tree from the file instead.
+        with open(ijd) as inf:
+            t, load_time = timed(tree_class().load_from_stream, inf, missense, gene)
+    tree_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rbfs, bfs_time = timed(t.breadth_first_expansion, t.root, True)
+    _, dist_time = timed(t.dists_to_root, t.root)
+    _, sc_time = timed(t.get_sum_and_count, rbfs)
+    return {
+        "backend":tree_class.__name__,
+        "nodes":len(rbfs),
+        "tree_mb":tree_bytes / 1e6,
+        "load_peak_mb":peak_bytes / 1e6,
+        "load_seconds":load_time,
+        "bfs_seconds":bfs_time,
+        "dists_to_root_seconds":dist_time,
+        "sum_and_count_seconds":sc_time,
+    }
+
+def main():
+    args = argparser()
+    gene = args.gene
+    if gene is not None and ',' in gene:
+        gene = gene.split(",")
+    ijd = read_input(args.input)
+    results = [compare_backend(tree_class, ijd, args.missense, gene) for tree_class in (Tree, CompactTree)]
+    keys = list(results[0].keys())
+    print(*keys, sep='\t')
+    for r in results:
+        print(*[round(r[k],4) if type(r[k]) == float else r[k] for k in keys], sep='\t')
+
+if __name__ == "__main__":
+    main()
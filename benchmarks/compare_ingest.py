@@ -0,0 +1,68 @@
+'''
+Compare peak memory and parse time of loading a tree through json.load against streaming it from the file.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from annotate_json import Tree, CompactTree
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Compare the peak memory and parse time of json.load and streaming ingest of an Auspice JSON.")
+    parser.add_argument("-i","--input",help="Name of an input JSON.",required=True)
+    parser.add_argument("-m","--missense",action='store_true',default=False,help="Use to only consider amino-acid altering mutations.")
+    parser.add_argument("-g","--gene",default=None,help="Only consider missense mutations within specific genes, ',' delimited.")
+    return parser.parse_args()
+
+def load_with_json(tree_class, path, missense, gene):
+    with open(path) as inf:
+        ijd = json.load(inf)
+    return tree_class().load_from_dict(ijd['tree'], 1, missense, gene)
+
+def load_with_stream(tree_class, path, missense, gene):
+    with open(path) as inf:
+        return tree_class().load_from_stream(inf, missense, gene)
+
+def measure(loader, tree_class, path, missense=False, gene=None):
+    start = time.perf_counter()
+    loader(tree_class, path, missense, gene)
+    seconds = time.perf_counter() - start
+    #tracing slows allocation down considerably, so memory is measured on a separate run.
+    tracemalloc.start()
+    t = loader(tree_class, path, missense, gene)
+    tree_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "backend":tree_class.__name__,
+        "ingest":loader.__name__[len("load_with_"):],
+        "parsimony":t.parsimony_score(),
+        "seconds":seconds,
+        "peak_mb":peak_bytes / 1e6,
+        "retained_mb":tree_bytes / 1e6,
+    }
+
+def main():
+    args = argparser()
+    gene = args.gene
+    if gene is not None and ',' in gene:
+        gene = gene.split(",")
+    results = []
+    for tree_class in (Tree, CompactTree):
+        for loader in (load_with_json, load_with_stream):
+            try:
+                results.append(measure(loader, tree_class, args.input, args.missense, gene))
+            except RecursionError:
+                #json.load can't read trees nested this deeply, so only streaming is reported for them.
+                print(f"Skipping json.load for {tree_class.__name__}; the input is nested too deeply.",file=sys.stderr)
+    keys = list(results[0].keys())
+    print(*keys, sep='\t')
+    for r in results:
+        print(*[round(r[k],4) if type(r[k]) == float else r[k] for k in keys], sep='\t')
+
+if __name__ == "__main__":
+    main()
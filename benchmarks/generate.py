@@ -0,0 +1,95 @@
+'''
+Generate synthetic Auspice v2 JSONs of controllable size and shape for benchmarking.
+'''
+
+import os
+import sys
+import math
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from annotate_json import write_annotated_json
+
+NUCLEOTIDES = "ACGT"
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Auspice v2 JSON with mutation annotations.")
+    parser.add_argument("-o","--output",help="Name of the output JSON.",required=True)
+    parser.add_argument("-n","--samples",type=int,default=10000,help="Number of samples (leaves) in the tree.")
+    parser.add_argument("-l","--ladder",type=float,default=0.3,help="Probability that an internal node splits off a single sample, giving deeper, ladder-like trees.")
+    parser.add_argument("-b","--branching",type=int,default=3,help="Maximum number of children of an internal node that doesn't split off a single sample.")
+    parser.add_argument("-m","--mutations",type=float,default=1.0,help="Mean number of nucleotide mutations per branch.")
+    parser.add_argument("-g","--genes",default="S,E,N",help="Comma-separated names of genes to annotate amino acid changes in. Pass an empty string for none.")
+    parser.add_argument("-a","--aa-rate",type=float,default=0.3,help="Probability that a nucleotide mutation changes an amino acid in one of the genes.")
+    parser.add_argument("--genome-length",type=int,default=30000,help="Length of the simulated genome.")
+    parser.add_argument("--seed",type=int,default=0,help="Random seed.")
+    return parser.parse_args()
+
+def poisson(rng, mean):
+    #Knuth's method; means here are small.
+    limit = math.exp(-mean)
+    k = 0
+    p = rng.random()
+    while p > limit:
+        k += 1
+        p *= rng.random()
+    return k
+
+def branch_mutations(rng, mutations, genes, aa_rate, genome_length):
+    muinfo = {}
+    for _ in range(poisson(rng, mutations)):
+        ref, alt = rng.sample(NUCLEOTIDES, 2)
+        muinfo.setdefault('nuc', []).append(ref + str(rng.randint(1, genome_length)) + alt)
+        if genes and rng.random() < aa_rate:
+            ref, alt = rng.sample(AMINO_ACIDS, 2)
+            muinfo.setdefault(rng.choice(genes), []).append(ref + str(rng.randint(1, genome_length // 3 // len(genes))) + alt)
+    return muinfo
+
+def generate_tree(samples=10000, ladder=0.3, branching=3, mutations=1.0, genes=("S","E","N"), aa_rate=0.3, genome_length=30000, seed=0):
+    """
+    Build an Auspice v2 JSON dictionary for a random tree with the given number of samples.
+
+    Each internal node splits off a single sample with probability ladder, and otherwise divides its samples among 2 to branching
+    children. Each branch carries a Poisson distributed number of nucleotide mutations with mean mutations, each of which also changes
+    an amino acid in a random one of genes with probability aa_rate.
+    """
+    rng = random.Random(seed)
+    genes = list(genes)
+    counter = 0
+    root = {}
+    #built from an explicit stack so that very ladder-like trees don't exceed the recursion limit.
+    stack = [(root, samples, 0)]
+    while stack:
+        node, n, div = stack.pop()
+        counter += 1
+        muinfo = branch_mutations(rng, mutations, genes, aa_rate, genome_length) if counter > 1 else {}
+        div += len(muinfo.get('nuc', []))
+        node['name'] = ("NODE_" if n > 1 else "sample_") + str(counter)
+        node['node_attrs'] = {'div':div}
+        node['branch_attrs'] = {'mutations':muinfo}
+        if n > 1:
+            if rng.random() < ladder:
+                parts = [1, n - 1]
+            else:
+                k = rng.randint(2, max(2, min(branching, n)))
+                cuts = sorted(rng.sample(range(1, n), k - 1))
+                parts = [b - a for a, b in zip([0] + cuts, cuts + [n])]
+            node['children'] = [{} for _ in parts]
+            stack.extend(reversed(list(zip(node['children'], parts, [div] * len(parts)))))
+    return {
+        'version':'v2',
+        'meta':{'title':'Synthetic benchmark tree', 'colorings':[], 'panels':['tree']},
+        'tree':root,
+    }
+
+def main():
+    args = argparser()
+    genes = [g for g in args.genes.split(",") if g != ""]
+    jd = generate_tree(args.samples, args.ladder, args.branching, args.mutations, genes, args.aa_rate, args.genome_length, args.seed)
+    #written without annotations, which reproduces json.dump without recursing into ladder-like trees.
+    write_annotated_json(jd, args.output, {}, {}, 0)
+
+if __name__ == "__main__":
+    main()
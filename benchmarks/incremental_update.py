@@ -0,0 +1,89 @@
+'''
+Compare a full re-annotation against an incremental update on a synthetic "add samples" workload.
+
+A random share of the input's samples is held back to make the older tree, which is annotated from scratch. The full tree is then
+annotated both from scratch and incrementally from the older run's report and labels, timing each and counting how many of the older
+lineage names still have the same signature mutations afterwards.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json_stream
+from annotate_json import load_tree, annotate_tree, PreviousAnnotation, read_previous_annotation, get_leaf_labels, get_lineage_roots, write_labels, generate_report
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Time a full re-annotation against an incremental update after adding samples to an Auspice JSON.")
+    parser.add_argument("-i","--input",help="Name of an input JSON.",required=True)
+    parser.add_argument("-p","--proportion",type=float,default=0.05,help="Proportion of samples added between the older and the newer tree.")
+    parser.add_argument("-s","--size",type=int,default=0,help="Set a minimum number of samples to annotate a lineage.")
+    parser.add_argument("-d","--distinction",type=int,default=0,help="Set a minimum number of mutations separating a new lineage label with its parent.")
+    parser.add_argument("-c","--cutoff",type=float,default=1,help="Proportion of samples that must be labeled on each level.")
+    parser.add_argument("--seed",type=int,default=0,help="Seed for choosing the added samples.")
+    parser.add_argument("--compact",action='store_true',default=False,help="Store the trees in flat arrays instead of node objects.")
+    return parser.parse_args()
+
+def remove_samples(jd, removed):
+    #prune the removed samples, and any internal node left without descendents, from a copy of the tree.
+    #only the nodes are copied, which unlike copy.deepcopy doesn't recurse on deep trees.
+    jd = dict(jd, tree=dict(jd['tree']))
+    stack = [jd['tree']]
+    order = []
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        if 'children' in node:
+            node['children'] = [dict(c) for c in node['children']]
+            stack.extend(node['children'])
+    for node in reversed(order):
+        if 'children' in node:
+            node['children'] = [c for c in node['children'] if c['name'] not in removed and ('children' not in c or len(c['children']) > 0)]
+    return jd
+
+def write_run(t, annotes, all_labels, prefix):
+    write_labels(get_leaf_labels(t, annotes, all_labels), prefix + ".labels.tsv")
+    generate_report(t, annotes, get_lineage_roots(annotes), prefix + ".report.tsv")
+    return read_previous_annotation(prefix + ".report.tsv", prefix + ".labels.tsv")[0]
+
+def stable_names(older, newer):
+    return sum(1 for ann, row in older.items() if ann != 'Root' and ann in newer and newer[ann][1] == row[1])
+
+def main():
+    args = argparser()
+    with open(args.input) as inf:
+        try:
+            jd = json.load(inf)
+        except RecursionError:
+            #too deeply nested for json.load; read it with the streaming tokenizer instead.
+            inf.seek(0)
+            jd = json_stream.load(inf)
+    params = (0, args.size, args.distinction, args.cutoff)
+    full = load_tree(jd, compact=args.compact)
+    leaves = full.get_leaves_ids()
+    removed = set(random.Random(args.seed).sample(leaves, int(len(leaves) * args.proportion)))
+    older = load_tree(remove_samples(jd, removed), compact=args.compact)
+    with tempfile.TemporaryDirectory() as scratch:
+        annotes, all_labels, _ = annotate_tree(older, *params, verbose=False)
+        older_lineages = write_run(older, annotes, all_labels, os.path.join(scratch, "older"))
+        lineages, samples = read_previous_annotation(os.path.join(scratch, "older.report.tsv"), os.path.join(scratch, "older.labels.tsv"))
+        start = time.perf_counter()
+        annotes, all_labels, _ = annotate_tree(full, *params, verbose=False)
+        full_seconds = time.perf_counter() - start
+        full_lineages = write_run(full, annotes, all_labels, os.path.join(scratch, "full"))
+        start = time.perf_counter()
+        annotes, all_labels, _ = annotate_tree(full, *params, verbose=False, previous=PreviousAnnotation(full, lineages, samples))
+        incremental_seconds = time.perf_counter() - start
+        incremental_lineages = write_run(full, annotes, all_labels, os.path.join(scratch, "incremental"))
+    print(f"Samples: {len(leaves) - len(removed)} before, {len(leaves)} after")
+    print("Mode","Seconds","Lineages","Stable Names",sep='\t')
+    for mode, seconds, result in [("full", full_seconds, full_lineages), ("incremental", incremental_seconds, incremental_lineages)]:
+        print(mode, round(seconds,3), len(result) - 1, f"{stable_names(older_lineages, result)}/{len(older_lineages) - 1}", sep='\t')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+'''
+Time each stage of the pipeline on synthetic or supplied Auspice JSONs and write the wall time and peak memory of every stage as JSON.
+
+Run from the repository root with python3 -m benchmarks.run, e.g.
+
+    python3 -m benchmarks.run -n 1000,10000,100000 --backend tree,compact -o results.json
+
+so that results from different versions can be compared stage by stage.
+'''
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from annotate_json import load_tree, evaluate_lineage, annotate_tree, get_leaf_labels, write_labels, get_lineage_roots, generate_report, write_annotated_json
+from benchmarks.generate import generate_tree
+
+BACKENDS = {'tree':False, 'compact':True}
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Time each pipeline stage on synthetic Auspice JSONs and write the results as JSON.")
+    parser.add_argument("-i","--input",default=None,help="Benchmark this Auspice JSON instead of generating trees.")
+    parser.add_argument("-o","--output",default=None,help="Name of the output JSON. Defaults to standard output.")
+    parser.add_argument("-n","--samples",default="1000,10000",help="Comma-separated numbers of samples of the generated trees.")
+    parser.add_argument("--ladder",type=float,default=0.3,help="Probability that an internal node splits off a single sample.")
+    parser.add_argument("--branching",type=int,default=3,help="Maximum number of children of an internal node.")
+    parser.add_argument("--mutations",type=float,default=1.0,help="Mean number of nucleotide mutations per branch.")
+    parser.add_argument("--genes",default="S,E,N",help="Comma-separated names of genes to annotate amino acid changes in.")
+    parser.add_argument("--seed",type=int,default=0,help="Random seed for the generated trees.")
+    parser.add_argument("--backend",default="tree",help="Comma-separated tree backends to benchmark, from tree and compact.")
+    parser.add_argument("-f","--floor",type=int,default=0,help="Set a minimum total value to annotate a lineage.")
+    parser.add_argument("-s","--size",type=int,default=0,help="Set a minimum number of samples to annotate a lineage.")
+    parser.add_argument("-d","--distinction",type=int,default=0,help="Set a minimum number of mutations separating a new lineage label with its parent.")
+    parser.add_argument("-c","--cutoff",type=float,default=1,help="Proportion of samples that must be labeled on each level.")
+    parser.add_argument("-l","--levels",type=int,default=0,help="Set a maximum number of levels to annotate.")
+    parser.add_argument("-m","--missense",action='store_true',default=False,help="Use to only consider amino-acid altering mutations.")
+    parser.add_argument("-g","--gene",default=None,help="Only consider missense mutations within specific genes, ',' delimited.")
+    parser.add_argument("--no-memory",action='store_true',default=False,help="Skip the traced second run of each stage that measures peak memory.")
+    return parser.parse_args()
+
+def measure(results, name, memory, func, *args):
+    """
+    Run func(*args), recording its wall time, and its peak traced memory from a second run unless memory is False, under name in results.
+    """
+    start = time.perf_counter()
+    value = func(*args)
+    results[name] = {'seconds':time.perf_counter() - start}
+    if memory:
+        #tracing slows allocation down considerably, so memory is measured on a separate run.
+        tracemalloc.start()
+        func(*args)
+        results[name]['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return value
+
+def load_json(path):
+    with open(path) as inf:
+        return json.load(inf)
+
+def write_leaf_labels(t, annotes, all_labels, path):
+    write_labels(get_leaf_labels(t, annotes, all_labels), path)
+
+def run_case(path, compact, params, missense=False, gene=None, memory=True):
+    """
+    Time every stage of the pipeline on one input JSON, returning the tree's size and the measurements of each stage in pipeline order.
+
+    Inputs nested too deeply for json.load have no load_json or load_tree stage.
+    """
+    floor, size, distinction, cutoff, maxlevels = params
+    stages = {}
+    try:
+        jd = measure(stages, 'load_json', memory, load_json, path)
+        t = measure(stages, 'load_tree', memory, load_tree, jd, missense, gene, compact)
+    except RecursionError:
+        #nested too deeply for json.load; only the streaming loader is timed and the output is written from the file.
+        jd = path
+        t = None
+    streamed = measure(stages, 'load_tree_stream', memory, load_tree, path, missense, gene, compact)
+    if t == None:
+        t = streamed
+    rpre = t.subtree(t.root, reverse=True)
+    dist_root = measure(stages, 'dists_to_root', memory, t.dists_to_root, t.root)
+    scdict, _ = measure(stages, 'sum_and_count', memory, t.get_sum_and_count, rpre)
+    measure(stages, 'evaluate_lineage', memory, evaluate_lineage, t, dist_root, t.root.id, rpre, scdict, size, distinction)
+    annotes, all_labels, level = measure(stages, 'annotate', memory, annotate_tree, t, floor, size, distinction, cutoff, maxlevels, 1, None, False)
+    with tempfile.TemporaryDirectory() as scratch:
+        measure(stages, 'labels', memory, write_leaf_labels, t, annotes, all_labels, os.path.join(scratch, "labels.tsv"))
+        annd = get_lineage_roots(annotes)
+        measure(stages, 'report', memory, generate_report, t, annotes, annd, os.path.join(scratch, "report.tsv"))
+        measure(stages, 'write_json', memory, write_annotated_json, jd, os.path.join(scratch, "annotated.json"), all_labels, annd, level, t)
+    return {
+        'nodes':len(rpre),
+        'samples':t.count_leaves(t.root),
+        'parsimony':t.parsimony_score(),
+        'lineages':len(annotes) - 1,
+        'levels':level,
+        'stages':stages,
+    }
+
+def main():
+    args = argparser()
+    gene = args.gene
+    if gene is not None and ',' in gene:
+        gene = gene.split(",")
+    params = (args.floor, args.size, args.distinction, args.cutoff, args.levels)
+    backends = args.backend.split(",")
+    for backend in backends:
+        if backend not in BACKENDS:
+            raise Exception(f"Unknown backend {backend}!")
+    cases = []
+    with tempfile.TemporaryDirectory() as scratch:
+        if args.input != None:
+            inputs = [(args.input, None)]
+        else:
+            inputs = []
+            for samples in [int(n) for n in args.samples.split(",")]:
+                generator = {'samples':samples, 'ladder':args.ladder, 'branching':args.branching, 'mutations':args.mutations,
+                             'genes':[g for g in args.genes.split(",") if g != ""], 'seed':args.seed}
+                path = os.path.join(scratch, f"synthetic_{samples}.json")
+                write_annotated_json(generate_tree(**generator), path, {}, {}, 0)
+                inputs.append((path, generator))
+        for path, generator in inputs:
+            for backend in backends:
+                print(f"Benchmarking {backend} backend on {generator['samples'] if generator != None else path}...",file=sys.stderr)
+                case = {'input':args.input, 'generator':generator, 'backend':backend}
+                case.update(run_case(path, BACKENDS[backend], params, args.missense, gene, not args.no_memory))
+                cases.append(case)
+    results = {
+        'python':platform.python_version(),
+        'platform':platform.platform(),
+        'parameters':dict(zip(['floor','size','distinction','cutoff','maxlevels','missense','gene'], list(params) + [args.missense, gene])),
+        'cases':cases,
+    }
+    if args.output != None:
+        with open(args.output,'w+') as of:
+            json.dump(results, of, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+'''
+Minimal incremental JSON tokenizer using only the standard library.
+
+Reads a text stream in chunks and yields parse events without materialising the document, so that large Auspice JSON can be
+consumed a node at a time. Events are (kind, value) pairs where kind is one of start_map, map_key, end_map, start_array,
+end_array or value.
+'''
+
+import io
+import re
+from json.decoder import scanstring, JSONDecodeError
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+NUMBER_CHARS = re.compile(r'[-+0-9.eE]*')
+NUMBER = re.compile(r'(-?(?:0|[1-9]\d*))(\.\d+)?([eE][-+]?\d+)?')
+#keyed by first character; json.load also accepts the non-standard constants, which json.dump writes for non-finite floats.
+LITERALS = {'t':('true',True), 'f':('false',False), 'n':('null',None),
+            'N':('NaN',float('nan')), 'I':('Infinity',float('inf')), '-':('-Infinity',float('-inf'))}
+
+def open_text(source):
+    '''
+    Return a text stream for a filename or a text or binary file object.
+    '''
+    if isinstance(source, str):
+        return open(source)
+    if isinstance(source, io.TextIOBase):
+        return source
+    return io.TextIOWrapper(source, encoding='utf-8')
+
+def iter_events(inf, chunk_size=1<<16):
+    buf = inf.read(chunk_size)
+    pos = 0
+    eof = len(buf) == 0
+    #one entry per open container, True for objects; expect_key is set whenever the next string in an object is a key.
+    containers = []
+    expect_key = False
+    while True:
+        pos = WHITESPACE.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                break
+            buf = inf.read(chunk_size)
+            pos = 0
+            eof = len(buf) == 0
+            continue
+        c = buf[pos]
+        need_more = False
+        if c == '{':
+            containers.append(True)
+            expect_key = True
+            pos += 1
+            yield ('start_map', None)
+        elif c == '}':
+            containers.pop()
+            expect_key = False
+            pos += 1
+            yield ('end_map', None)
+        elif c == '[':
+            containers.append(False)
+            pos += 1
+            yield ('start_array', None)
+        elif c == ']':
+            containers.pop()
+            pos += 1
+            yield ('end_array', None)
+        elif c == ',':
+            expect_key = len(containers) > 0 and containers[-1]
+            pos += 1
+        elif c == ':':
+            pos += 1
+        elif c == '"':
+            try:
+                value, end = scanstring(buf, pos+1)
+            except JSONDecodeError:
+                #the string may simply run past the end of the buffer.
+                if eof:
+                    raise
+                need_more = True
+            else:
+                pos = end
+                if expect_key:
+                    expect_key = False
+                    yield ('map_key', value)
+                else:
+                    yield ('value', value)
+        elif c in LITERALS and (c != '-' or buf.startswith('-I', pos)):
+            #a lone '-' at the end of the buffer is left to the number branch, which reads more first.
+            literal, value = LITERALS[c]
+            if len(buf) - pos < len(literal) and not eof:
+                need_more = True
+            elif buf.startswith(literal, pos):
+                pos += len(literal)
+                yield ('value', value)
+            else:
+                raise JSONDecodeError("Expecting value", buf, pos)
+        else:
+            #a number is only known to be complete once something other than a number character follows it.
+            extent = NUMBER_CHARS.match(buf, pos).end()
+            m = NUMBER.match(buf, pos, extent)
+            if extent == len(buf) and not eof:
+                need_more = True
+            elif m == None or m.end() != extent:
+                raise JSONDecodeError("Expecting value", buf, pos)
+            else:
+                integer, frac, exp = m.groups()
+                pos = m.end()
+                if frac or exp:
+                    yield ('value', float(m.group()))
+                else:
+                    yield ('value', int(integer))
+        if need_more:
+            more = inf.read(max(chunk_size, len(buf) - pos))
+            eof = len(more) == 0
+            buf = buf[pos:] + more
+            pos = 0
+
+def build_value(events, kind, value):
+    '''
+    Materialise the value that starts with the event (kind, value), consuming the rest of its events.
+    '''
+    if kind == 'value':
+        return value
+    root = {} if kind == 'start_map' else []
+    stack = [root]
+    key = None
+    for kind, value in events:
+        if kind == 'map_key':
+            key = value
+            continue
+        if kind == 'end_map' or kind == 'end_array':
+            stack.pop()
+            if len(stack) == 0:
+                return root
+            continue
+        if kind == 'start_map':
+            value = {}
+        elif kind == 'start_array':
+            value = []
+        container = stack[-1]
+        if type(container) == dict:
+            container[key] = value
+        else:
+            container.append(value)
+        if kind == 'start_map' or kind == 'start_array':
+            stack.append(value)
+    raise JSONDecodeError("Unexpected end of document", "", 0)
+
+def load(inf):
+    '''
+    Read a whole JSON document like json.load does, without recursing, so that it can be nested arbitrarily deeply.
+    '''
+    events = iter_events(inf)
+    for kind, value in events:
+        return build_value(events, kind, value)
+    raise JSONDecodeError("Expecting value", "", 0)
+
+def skip_value(events, kind):
+    '''
+    Consume the rest of the value that starts with an event of the given kind without building it.
+    '''
+    if kind != 'start_map' and kind != 'start_array':
+        return
+    depth = 1
+    for kind, _ in events:
+        if kind == 'start_map' or kind == 'start_array':
+            depth += 1
+        elif kind == 'end_map' or kind == 'end_array':
+            depth -= 1
+            if depth == 0:
+                return
+    raise JSONDecodeError("Unexpected end of document", "", 0)
+
+def iter_value_events(obj):
+    '''
+    Yield the same events as iter_events for an already loaded value.
+    '''
+    if type(obj) != dict and type(obj) != list:
+        yield ('value', obj)
+        return
+    #each entry pairs an iterator over an open container with whether that container is an object.
+    stack = []
+    item = obj
+    while True:
+        if type(item) == dict:
+            stack.append((iter(item.items()), True))
+            yield ('start_map', None)
+        elif type(item) == list:
+            stack.append((iter(item), False))
+            yield ('start_array', None)
+        else:
+            yield ('value', item)
+        while stack:
+            items, is_map = stack[-1]
+            item = next(items, items)
+            if item is not items:
+                break
+            stack.pop()
+            yield ('end_map', None) if is_map else ('end_array', None)
+        else:
+            return
+        if is_map:
+            key, item = item
+            yield ('map_key', key)
@@ -0,0 +1,93 @@
+'''
+Optional instrumentation of pipeline runs.
+
+A Profiler passed to pipeline records the wall time and memory high-water mark of each stage, what was done on each level of annotation
+and for each lineage subdivided, and can dump cProfile statistics for each stage. Without one, pipeline does no extra work.
+'''
+
+import os
+import sys
+import json
+import time
+import cProfile
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    #not available on Windows; memory is then left out of the trace.
+    resource = None
+
+def max_rss_mb():
+    if resource == None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #reported in bytes on macOS and kilobytes elsewhere.
+    return rss / 1e6 if sys.platform == 'darwin' else rss / 1e3
+
+def stage(profiler, name):
+    '''
+    Return a context manager timing the named stage on profiler, or doing nothing if profiler is None.
+    '''
+    if profiler == None:
+        return contextlib.nullcontext()
+    return profiler.stage(name)
+
+class Profiler:
+    '''
+    Collects a structured trace of one pipeline run.
+
+    If stats_dir is given, each stage is also run under cProfile and its statistics are written there as <stage>.prof. Work done in
+    worker processes is timed but doesn't appear in those statistics.
+    '''
+    def __init__(self, stats_dir=None):
+        self.stats_dir = stats_dir
+        self.stages = []
+        self.levels = []
+        self.lineages = []
+        self.start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        profile = None
+        if self.stats_dir != None:
+            profile = cProfile.Profile()
+            profile.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profile != None:
+                profile.disable()
+                os.makedirs(self.stats_dir, exist_ok=True)
+                profile.dump_stats(os.path.join(self.stats_dir, name + ".prof"))
+            self.stages.append({'stage':name, 'seconds':seconds, 'max_rss_mb':max_rss_mb()})
+
+    def record_level(self, level, parents, lineages, seconds):
+        self.levels.append({'level':level, 'parents':parents, 'lineages':lineages, 'seconds':seconds})
+
+    def record_lineage(self, level, lineage, stats):
+        '''
+        Record the stats collected by subdivide_lineage while subdividing one lineage.
+        '''
+        self.lineages.append(dict(stats, level=level, lineage=lineage))
+
+    def trace(self):
+        totals = {}
+        for record in self.lineages:
+            for key, value in record.items():
+                if key != 'level' and key != 'lineage':
+                    totals[key] = totals.get(key, 0) + value
+        return {
+            'seconds':time.perf_counter() - self.start,
+            'max_rss_mb':max_rss_mb(),
+            'stages':self.stages,
+            'levels':self.levels,
+            'lineage_totals':totals,
+            'lineages':self.lineages,
+        }
+
+    def write(self, path):
+        with open(path,'w+') as of:
+            json.dump(self.trace(), of, indent=1)
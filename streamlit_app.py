@@ -1,19 +1,56 @@
 import streamlit as st
+import io
 import os
 import sys
-import json
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from annotate_json import *
+import tree_cache
 import zipfile
 
-from streamlit.runtime.scriptrunner_utils.script_run_context import get_script_run_ctx
 import streamlit.components.v1 as components
 
-def _get_session():
-    ctx = get_script_run_ctx()
-    if ctx is None:
-        raise Exception("Failed to get the thread context")            
-    return ctx.session_id
-    
+#jobs beyond this many wait in the executor's queue until a worker frees up.
+MAX_CONCURRENT_JOBS = 2
+
+class Job:
+    '''
+    A single background pipeline run for one session, with its progress messages and, once finished, the zipped results.
+    '''
+    def __init__(self):
+        self.messages = ["Queued."]
+        self.lock = threading.Lock()
+        self.future = None
+        self.reported = False
+
+    def progress(self, message):
+        with self.lock:
+            self.messages.append(message)
+
+    def get_messages(self):
+        with self.lock:
+            return list(self.messages)
+
+@st.cache_resource
+def _get_executor():
+    #shared by every session, so that the number of pipelines running at once is bounded across the whole app.
+    return ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS)
+
+def _run_job(job, data, floor, size, distinction, cutoff, missense, gene, levels):
+    job.progress("Started.")
+    #each job writes to its own scratch directory, which is removed once the results are zipped in memory.
+    with tempfile.TemporaryDirectory() as scratch:
+        outputs = {name:os.path.join(scratch, name) for name in ["annotated.json","labels.tsv","report.tsv"]}
+        source = io.BytesIO(data)
+        pipeline(source,outputs["annotated.json"],floor,size,distinction,cutoff,missense,gene,levels,outputs["labels.tsv"],outputs["report.tsv"],cache_dir=tree_cache.default_cache_dir(source),progress=job.progress)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer,'w',zipfile.ZIP_DEFLATED) as zipf:
+            for name, path in outputs.items():
+                zipf.write(path, arcname=name)
+    job.progress("Done.")
+    return buffer.getvalue()
+
 st.set_page_config(layout='wide')
 with st.form(key="autolin"):
     st.markdown("# AUTOLIN")
@@ -43,27 +80,40 @@ with st.form(key="autolin"):
     st.markdown("Once uploaded to Auspice, the different lineage label levels can be viewed using the 'Color By' dropdown menu, as the 'GRI Lineage Level X' labels.")
     st.markdown("Any questions, problems, or suggestions can be posted on the [Github repo!](https://github.com/jmcbroome/automated-lineage-json/issues)")
 
-pref = _get_session()
 if runbutton:
-    if uploaded_file == None:
+    job = st.session_state.get("job", None)
+    if job != None and not job.future.done():
+        st.write("ERROR: Wait for the current run to finish first!")
+    elif uploaded_file == None:
         st.write("ERROR: Upload a file first!")
     else:
-        ijd = json.load(uploaded_file)
         if gene == "":
             genearg = None
         else:
             genearg = gene
-        pipeline(ijd,"annotated.json",floor,size,distinction,cutoff,missense,genearg,levels,"labels.tsv","report.tsv")
-        with zipfile.ZipFile(pref+'_results.zip','w') as zipf:
-            zipf.write("annotated.json")
-            zipf.write("labels.tsv")
-            zipf.write("report.tsv")
-        with open(pref+"_results.zip","rb") as f:
-            db = st.download_button(label="Download Annotated JSON and Table in ZIP Format", file_name="results.zip", data=f.read())
-            if db != None:
-                print("Attempting to clear temp files.")
-                for seshfile in ["annotated.json","labels.tsv","report.tsv",pref+"_results.zip"]:
-                    if os.path.exists(seshfile):
-                        print("Clearing temporary file: " + seshfile,file=sys.stderr)
-                        os.remove(seshfile)
+        job = Job()
+        job.future = _get_executor().submit(_run_job,job,uploaded_file.getvalue(),floor,size,distinction,cutoff,missense,genearg,levels)
+        st.session_state["job"] = job
+
+@st.fragment(run_every=1.0)
+def _show_progress():
+    #reruns on its own every second, so progress updates without reloading the rest of the page.
+    job = st.session_state.get("job", None)
+    if job == None:
+        return
+    for message in job.get_messages():
+        st.text(message)
+    if job.future.done() and not job.reported:
+        #rerun the whole app once so the results are shown outside this fragment.
+        job.reported = True
+        st.rerun()
+
+_show_progress()
+job = st.session_state.get("job", None)
+if job != None and job.reported:
+    if job.future.exception() != None:
+        st.write("ERROR: " + str(job.future.exception()))
+        print(f"Job failed: {job.future.exception()}",file=sys.stderr)
+    else:
+        st.download_button(label="Download Annotated JSON and Table in ZIP Format", file_name="results.zip", data=job.future.result())
 components.iframe("https://auspice.us/", height=1000, scrolling=True)
@@ -0,0 +1,73 @@
+'''
+CandidateHeap must pick the same lineage roots, in the same order and with the same tie-breaking, as repeated calls to evaluate_lineage.
+'''
+
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from annotate_json import load_tree, annotate_tree, evaluate_lineage, evaluate_candidate, CandidateHeap
+from benchmarks.generate import generate_tree
+
+class TestCandidateHeap(unittest.TestCase):
+    def reference_picks(self, t, pnode, size, distinction):
+        #the scan CandidateHeap replaced: every node of the lineage, in reverse breadth-first order, rescored for each pick.
+        rbfs = t.breadth_first_expansion(pnode, True)
+        dist_root = t.dists_to_root(pnode)
+        scdict, _ = t.get_sum_and_count(rbfs)
+        banned = set()
+        picks = []
+        ties = 0
+        while True:
+            best_score, best = evaluate_lineage(t, dist_root, pnode.id, rbfs, scdict, size, distinction, banned)
+            if best == None:
+                break
+            scores = [evaluate_candidate(pnode.id, c.id, scdict, dist_root, size, distinction) for c in rbfs if c.id not in banned]
+            ties += scores.count(best_score) > 1
+            picks.append((best_score, best.id))
+            banned.update(t.rsearch(best))
+            t.remove_from_sum_and_count(scdict, best, pnode.id)
+        return picks, ties
+
+    def heap_picks(self, t, pnode, size, distinction):
+        #the same loop as subdivide_lineage.
+        rpre = t.subtree(pnode, reverse=True)
+        scdict, _ = t.get_sum_and_count(rpre)
+        candidates = CandidateHeap(pnode.id, rpre, scdict, t.dists_to_root(pnode), size, distinction, set(), t.reverse_bfs_rank)
+        picks = []
+        while True:
+            best_score, best = candidates.best()
+            if best == None:
+                break
+            picks.append((best_score, best.id))
+            ancestors = t.rsearch(best)
+            candidates.banned.update(ancestors)
+            changed = t.remove_from_sum_and_count(scdict, best, pnode.id)
+            candidates.update(changed + ancestors)
+        return picks
+
+    def test_random_trees(self):
+        ties = 0
+        for compact in (False, True):
+            for seed in range(10):
+                rng = random.Random(seed)
+                #few mutations per branch leave long runs of zero-mutation branches, whose nodes tie on GRI.
+                jd = generate_tree(samples=rng.randint(20, 250), ladder=rng.random(), branching=rng.randint(2, 5),
+                                   mutations=rng.choice([0.2, 0.5, 1.0, 2.0]), genes=(), seed=seed)
+                size = seed % 3
+                distinction = seed % 2
+                with self.subTest(compact=compact, seed=seed):
+                    t = load_tree(jd, compact=compact)
+                    annotes, _, _ = annotate_tree(t, 0, size, distinction, 1, 3, verbose=False)
+                    for nid in annotes.values():
+                        pnode = t.get_node(nid)
+                        expected, lineage_ties = self.reference_picks(t, pnode, size, distinction)
+                        self.assertEqual(self.heap_picks(t, pnode, size, distinction), expected)
+                        ties += lineage_ties
+        #make sure the comparison actually exercised tie-breaking.
+        self.assertGreater(ties, 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+'''
+Loading, distances and JSON output must work on trees far deeper than the recursion limit.
+'''
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from annotate_json import Tree, CompactTree, write_annotated_json, read_input
+from json_stream import iter_events
+
+DEPTH = 100000
+
+def ladder(depth):
+    #each level splits off one sample and every branch carries one mutation, so sample_k is k mutations from the root.
+    root = {'name':'NODE_0', 'node_attrs':{'div':0}, 'branch_attrs':{'mutations':{}}}
+    cnode = root
+    for level in range(1, depth + 1):
+        leaf = {'name':'sample_' + str(level), 'node_attrs':{'div':level}, 'branch_attrs':{'mutations':{'nuc':['A' + str(level) + 'T']}}}
+        inner = {'name':'NODE_' + str(level), 'node_attrs':{'div':level}, 'branch_attrs':{'mutations':{'nuc':['C' + str(level) + 'G']}}}
+        cnode['children'] = [leaf, inner]
+        cnode = inner
+    return {'version':'v2', 'meta':{'colorings':[]}, 'tree':root}
+
+class TestDeepTrees(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.jd = ladder(DEPTH)
+        cls.scratch = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.scratch.name, "ladder.json")
+        write_annotated_json(cls.jd, cls.path, {}, {}, 0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.scratch.cleanup()
+
+    def check_tree(self, t):
+        self.assertEqual(t.count_leaves(t.root), DEPTH + 1)
+        self.assertEqual(t.parsimony_score(), 2 * DEPTH)
+        dists = t.dists_to_root(t.root)
+        self.assertEqual(len(dists), 2 * DEPTH + 1)
+        self.assertEqual(dists['sample_' + str(DEPTH)], DEPTH)
+        deepest = t.get_node('sample_' + str(DEPTH))
+        self.assertEqual(len(t.rsearch(deepest)), DEPTH + 1)
+
+    def test_load_from_dict(self):
+        for tree_class in (Tree, CompactTree):
+            with self.subTest(backend=tree_class.__name__):
+                self.check_tree(tree_class().load_from_dict(self.jd['tree']))
+
+    def test_load_from_stream(self):
+        for tree_class in (Tree, CompactTree):
+            with self.subTest(backend=tree_class.__name__):
+                with open(self.path) as inf:
+                    self.check_tree(tree_class().load_from_stream(inf))
+
+    def test_read_input_streams_deep_files(self):
+        self.assertEqual(read_input(self.path), self.path)
+
+    def test_write_annotated_json(self):
+        t = CompactTree().load_from_dict(self.jd['tree'])
+        #label the lower half of the ladder as A and its last branch as A.1.
+        mid = t.get_node('sample_' + str(DEPTH // 2)).parent
+        labels = {n.id:'A' for n in t.subtree(mid)}
+        labels['sample_' + str(DEPTH)] = 'A.1'
+        #lineage roots are keyed by depth-first position, on which sample_k is node_2k-1.
+        annd = {mid.id:['A'], 'node_' + str(2 * DEPTH - 1):['A.1']}
+        out = os.path.join(self.scratch.name, "annotated.json")
+        write_annotated_json(self.jd, out, labels, annd, 2, t)
+        values = {}
+        roots = []
+        depth = 0
+        max_depth = 0
+        key = None
+        with open(out) as inf:
+            for kind, value in iter_events(inf):
+                if kind == 'start_map' or kind == 'start_array':
+                    depth += 1
+                    max_depth = max(max_depth, depth)
+                elif kind == 'end_map' or kind == 'end_array':
+                    depth -= 1
+                elif kind == 'map_key':
+                    key = value
+                elif key == 'value' and value != None:
+                    values[value] = values.get(value, 0) + 1
+                elif key == 'GRI Lineage Root':
+                    roots.append(value)
+        self.assertGreater(max_depth, 2 * DEPTH)
+        self.assertEqual(roots, ['A', 'A.1'])
+        #two level keys on every node; the lower half is A on both levels except A.1's sample.
+        lower = len(t.subtree(mid))
+        self.assertEqual(values['A'], 2 * lower - 1)
+        self.assertEqual(values['A.1'], 1)
+        self.assertEqual(values['not assigned'], 2 * (2 * DEPTH + 1 - lower))
+
+if __name__ == "__main__":
+    unittest.main()
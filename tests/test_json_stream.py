@@ -0,0 +1,79 @@
+'''
+The streaming tokenizer must read the same values as json.load, wherever its chunks happen to split the input.
+'''
+
+import io
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_stream import iter_events, iter_value_events, build_value, load
+from annotate_json import write_annotated_json
+
+DOCUMENTS = [
+    '{"a": [1, -2, 3.5, -0.25e-3, 1E+2, 0], "b": {"c": null, "d": true, "e": false}, "f": "x\\"y\\u00e9\\\\"}',
+    '[NaN, Infinity, -Infinity, -1, {"g": [NaN]}, -Infinity]',
+    '{"node_attrs": {"div": NaN, "num_date": {"value": Infinity, "confidence": [-Infinity, 2021.5]}}}',
+    '  [ [] , {} , "" , -0 , 12345678901234567890 ]  ',
+    '-Infinity',
+    '3',
+]
+
+def tokenize(text, chunk_size):
+    events = iter_events(io.StringIO(text), chunk_size)
+    kind, value = next(events)
+    return build_value(events, kind, value)
+
+class TestJsonStream(unittest.TestCase):
+    def test_small_chunks(self):
+        for text in DOCUMENTS:
+            expected = json.dumps(json.loads(text))
+            for chunk_size in range(1, 8):
+                with self.subTest(text=text, chunk_size=chunk_size):
+                    self.assertEqual(json.dumps(tokenize(text, chunk_size)), expected)
+
+    def test_load(self):
+        for text in DOCUMENTS:
+            with self.subTest(text=text):
+                self.assertEqual(json.dumps(load(io.StringIO(text))), json.dumps(json.loads(text)))
+        depth = 100000
+        nested = load(io.StringIO('[' * depth + ']' * depth))
+        levels = 1
+        while len(nested) > 0:
+            nested = nested[0]
+            levels += 1
+        self.assertEqual(levels, depth)
+        with self.assertRaises(json.JSONDecodeError):
+            load(io.StringIO(' '))
+
+    def test_value_events(self):
+        for text in DOCUMENTS:
+            with self.subTest(text=text):
+                self.assertEqual(json.dumps(list(iter_value_events(json.loads(text)))), json.dumps(list(iter_events(io.StringIO(text)))))
+
+    def test_invalid(self):
+        for text in ['[Nan]', '[-Inf]', '[-]', '[1.]', '[tru]', '[Infinite]']:
+            for chunk_size in (1, 3, 1<<16):
+                with self.subTest(text=text, chunk_size=chunk_size):
+                    with self.assertRaises(json.JSONDecodeError):
+                        list(iter_events(io.StringIO(text), chunk_size))
+
+    def test_write_non_finite(self):
+        #the annotated output of a tree carrying non-finite values is what json.dump writes for them.
+        jd = {'version':'v2', 'meta':{'colorings':[]}, 'tree':{'name':'root', 'node_attrs':{'div':float('nan')}, 'children':[
+            {'name':'a', 'node_attrs':{'div':float('inf')}}, {'name':'b', 'node_attrs':{'div':float('-inf')}}]}}
+        with tempfile.TemporaryDirectory() as scratch:
+            path = os.path.join(scratch, "input.json")
+            with open(path,'w+') as of:
+                json.dump(jd, of)
+            for source in (jd, path):
+                out = os.path.join(scratch, "output.json")
+                write_annotated_json(source, out, {}, {}, 0)
+                with open(out) as inf:
+                    self.assertEqual(inf.read(), json.dumps(jd))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+'''
+Incremental maintenance of lineage sums and counts must match recomputing them from scratch.
+'''
+
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from annotate_json import load_tree, CandidateHeap
+from benchmarks.generate import generate_tree
+
+class TestRemoveFromSumAndCount(unittest.TestCase):
+    def check_lineage(self, t, pnode, size=0, distinction=0):
+        #accept roots the way subdivide_lineage does, comparing against a full recomputation after each one.
+        rpre = t.subtree(pnode, reverse=True)
+        scdict, _ = t.get_sum_and_count(rpre)
+        candidates = CandidateHeap(pnode.id, rpre, scdict, t.dists_to_root(pnode), size, distinction, set(), t.reverse_bfs_rank)
+        labeled = set()
+        accepted = []
+        while True:
+            _, best = candidates.best()
+            if best == None:
+                break
+            for anc in t.rsearch(best):
+                candidates.banned.add(anc)
+            labeled.update(n.id for n in t.subtree(best) if n.is_leaf())
+            changed = t.remove_from_sum_and_count(scdict, best, pnode.id)
+            expected, _ = t.get_sum_and_count(rpre, ignore=labeled)
+            self.assertEqual(scdict, expected)
+            candidates.update(changed + t.rsearch(best))
+            accepted.append(best)
+        return accepted
+
+    def test_random_trees(self):
+        for compact in (False, True):
+            for seed in range(8):
+                rng = random.Random(seed)
+                jd = generate_tree(samples=rng.randint(20, 300), ladder=rng.random(), branching=rng.randint(2, 5),
+                                   mutations=rng.choice([0.5, 1.0, 3.0]), seed=seed)
+                with self.subTest(compact=compact, seed=seed):
+                    t = load_tree(jd, compact=compact)
+                    roots = self.check_lineage(t, t.root, size=seed % 3)
+                    self.assertGreater(len(roots), 0)
+                    #sublineages stop updating at their own lineage root rather than the tree root.
+                    for lineage in roots[:3]:
+                        self.check_lineage(t, lineage)
+
+if __name__ == "__main__":
+    unittest.main()
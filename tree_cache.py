@@ -0,0 +1,102 @@
+'''
+On-disk cache of loaded trees, keyed by the content of the input JSON. Cached trees keep every mutation category, so the same entry
+serves any missense and gene settings.
+
+Entries are CompactTree binary files (see CompactTree.save) kept in a single directory that is trimmed back to a size limit,
+least recently used first.
+'''
+
+import os
+import sys
+import json
+import hashlib
+import tempfile
+
+CACHE_SUFFIX = ".gritree"
+
+def file_digest(source, chunk_size=1<<20):
+    '''
+    Return the SHA-256 hex digest of a filename or open file. Open files are rewound afterwards.
+    '''
+    digest = hashlib.sha256()
+    if type(source) == str:
+        with open(source, 'rb') as inf:
+            for chunk in iter(lambda: inf.read(chunk_size), b''):
+                digest.update(chunk)
+    else:
+        source.seek(0)
+        while True:
+            chunk = source.read(chunk_size)
+            if len(chunk) == 0:
+                break
+            digest.update(chunk if type(chunk) == bytes else chunk.encode('utf-8'))
+        source.seek(0)
+    return digest.hexdigest()
+
+def cache_key(source, version=""):
+    '''
+    Build the cache key for loading source.
+    version identifies the file format, so that entries written in an older format are never reused.
+    '''
+    settings = json.dumps([version, file_digest(source)])
+    return hashlib.sha256(settings.encode('utf-8')).hexdigest()
+
+def default_cache_dir(source):
+    '''
+    Return the cache directory kept next to an input file, or in the system temporary directory for open files.
+    '''
+    if type(source) == str:
+        return os.path.join(os.path.dirname(os.path.abspath(source)), ".gri_cache")
+    return os.path.join(tempfile.gettempdir(), "gri_cache")
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key + CACHE_SUFFIX)
+
+def touch(path):
+    #modification times double as last-use times for eviction.
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def store(cache_dir, key, save, max_bytes):
+    '''
+    Write a new entry with save(path), then evict the least recently used entries until the cache fits in max_bytes.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(cache_dir, key)
+    #write under a temporary name first so that concurrent runs never map a partially written entry.
+    fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=cache_dir)
+    os.close(fd)
+    try:
+        save(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    evict(cache_dir, max_bytes, keep=path)
+    return path
+
+def evict(cache_dir, max_bytes, keep=None):
+    entries = []
+    for fname in os.listdir(cache_dir):
+        if fname.endswith(CACHE_SUFFIX):
+            path = os.path.join(cache_dir, fname)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+    total = sum(e[1] for e in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            print(f"Evicted cached tree {path}.", file=sys.stderr)
+        except OSError:
+            pass
+        total -= size